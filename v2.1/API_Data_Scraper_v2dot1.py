@@ -11,6 +11,8 @@
     "\n",
     "### Implemented Functions\n",
     "\n",
+    "- `get_boxscore(game_id)`: returns the boxscore JSON of the game. The roster, position and goalie functions below take it as an optional `boxscore` argument so that a game's boxscore only has to be downloaded once.\n",
+    "\n",
     "- `get_away_roster(game_id)`: returns a dictionary with player names and IDs of the away roster.\n",
     "- `get_home_roster(game_id)`: returns a dictionary with player names and IDs of the home roster.\n",
     "- `get_game_roster(game_id)`: returns a dictionary with player names and IDs of both teams.\n",
@@ -21,7 +23,18 @@
     "- `get_goalies_id(game_id)`: returns list of player_ids belonging to the goalies of the game.\n",
     "\n",
     "- `get_play_by_play(game_id)`: returns a pandas DataFrame of the play-by-play. \n",
-    "- `get_multi_play_by_play([list of game ids])`: returns a pandas DataFrame of the play-by-play of all the listed games. \n",
+    "- `async_get_play_by_play(game_id)` / `async_get_multi_play_by_play([list of game ids], max_concurrency=8)`: async versions of the above that download the play-by-play, boxscore and shifts of a game at the same time and run many games over one event loop.\n",
+    "- `get_multi_play_by_play([list of game ids], max_workers=1, as_generator=False)`: returns a pandas DataFrame of the play-by-play of all the listed games. With `max_workers` > 1 the games are scraped concurrently on a thread pool (still returned in the order given), and games that fail are skipped and listed at the end instead of stopping the run. With `as_generator=True` it yields one DataFrame per game instead, so a whole season can be processed without holding it all in memory.\n",
+    "\n",
+    "- `get_toi(shifts, pbp=None, by_game=True)`: returns each player's time on ice (in seconds) per game from one or more shift frames, by period and, when the play-by-play is given, by strength (5v5, PP, SH, other even strength, empty net).\n",
+    "- `get_shared_ice(shifts, player_index=None)`: returns sparse player x player matrices of the seconds every pair of players spent on the ice together as teammates and as opponents, for one game or added up over many.\n",
+    "- `get_event_incidence(pbp)`: returns a sparse events x players matrix (`+1` home, `-1` away for every player on the ice) and its player index, so on-ice totals are matrix-vector products. `get_play_by_play` and `get_multi_play_by_play` return it too with `incidence=True`.\n",
+    "- `get_on_ice_shots(pbp, by_strength=True)`: returns on-ice shot attempts (Corsi), unblocked attempts (Fenwick), shots on goal and goals for and against per player and game, split by strength.\n",
+    "- `LiveGame(game_id)`: follows an in-progress game. Each `update()` parses only the new plays and matches on-ice players only for them and for the events affected by changed shifts.\n",
+    "- `store_game(game_id)` / `read_store(table, columns, season, game_type, team, event)`: write a game's play-by-play and shifts to a Parquet store partitioned by season and game type, and read back only the needed columns and rows. Once a final game is in the store, `get_play_by_play` reads it from there.\n",
+    "- `backfill([list of game ids], manifest_path='backfill_manifest.json', max_workers=1)`: scrapes games straight into the store. It records each game's progress in a manifest so an interrupted run picks up where it stopped and only retries the games that failed.\n",
+    "- `get_schedule(season)` / `get_schedule(start_date=..., end_date=...)`: returns the regular season and playoff games with their IDs and game states from the schedule endpoint. `scrape_season(season, max_workers=1)` scrapes every game of the season that has been played.\n",
+    "- `sync(season)` / `sync(range_of_ids=[...])`: stores only the games that are missing from the store or were not final when they were stored.\n",
     "\n",
     "\n",
     "### Other Functions to Implement\n",
@@ -56,10 +69,21 @@
    "metadata": {},
    "outputs": [],
    "source": [
+    "import os\n",
+    "import gzip\n",
+    "import json\n",
+    "import glob\n",
+    "import time\n",
+    "import bisect\n",
+    "import asyncio\n",
+    "import threading\n",
+    "from collections import deque\n",
+    "from itertools import islice\n",
+    "from concurrent.futures import ThreadPoolExecutor\n",
     "import requests\n",
     "import pandas as pd\n",
     "import numpy as np\n",
-    "from datetime import datetime"
+    "from scipy import sparse"
    ]
   },
   {
@@ -72,6 +96,191 @@
     "game_id = 2023020001"
    ]
   },
+  {
+   "cell_type": "markdown",
+   "id": "edd4c3f5",
+   "metadata": {},
+   "source": [
+    "## Fetching\n",
+    "\n",
+    "All requests go through one keep-alive `requests.Session` so the TCP/TLS handshake with `api-web.nhle.com` and `api.nhle.com` is only paid once per host instead of once per request. The base URLs, timeouts, headers and pool size are set here. `set_session` swaps in any object with a `get(url, timeout=...)` method, e.g. a session pointed at a local stand-in server for testing and benchmarking. `set_api_urls` points the scraper at a different host (such as that stand-in server) instead."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "1b4ad795",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "api_web_url = 'https://api-web.nhle.com/v1'\n",
+    "api_stats_url = 'https://api.nhle.com/stats/rest/en'\n",
+    "\n",
+    "request_timeout = (5, 30) # (connect, read) in seconds\n",
+    "request_headers = {'User-Agent' : 'NHL-API-Scraper', 'Accept' : 'application/json'}\n",
+    "pool_size = 16 # connections kept open per host\n",
+    "\n",
+    "\n",
+    "def make_session(pool_size=pool_size, headers=request_headers):\n",
+    "    \n",
+    "    session = requests.Session()\n",
+    "    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)\n",
+    "    session.mount('https://', adapter)\n",
+    "    session.mount('http://', adapter)\n",
+    "    session.headers.update(headers)\n",
+    "    \n",
+    "    return session\n",
+    "\n",
+    "\n",
+    "session = make_session()\n",
+    "\n",
+    "\n",
+    "def set_session(new_session):\n",
+    "    \n",
+    "    global session\n",
+    "    session = new_session\n",
+    "\n",
+    "\n",
+    "def set_api_urls(new_web_url, new_stats_url):\n",
+    "    \n",
+    "    global api_web_url, api_stats_url\n",
+    "    api_web_url = new_web_url\n",
+    "    api_stats_url = new_stats_url"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "8993b373",
+   "metadata": {},
+   "source": [
+    "### Raw Response Cache\n",
+    "\n",
+    "With `set_cache('raw_cache')` every raw JSON response (play-by-play, boxscore, shiftcharts and player landing) is also saved gzipped under `raw_cache/{endpoint}/{id}.json.gz`. With `set_cache('raw_cache', offline=True)` nothing goes over the network: `get_play_by_play` and the other fetch functions read only from the cache (and fail for anything that isn't in it), so reprocessing games that have already been downloaded, e.g. after fixing a bug in `parse_events`, is CPU-bound only.\n",
+    "\n",
+    "Once a game is final (`gameState` `OFF` or `FINAL` in its play-by-play or boxscore) its responses don't change any more. Its play-by-play, boxscore and shifts are then served from the cache without going over the network, as long as they were cached after the game went final. The shift chart is often still empty right after a game ends, so an empty one is never kept for good. Anything else that is cached (games that aren't final yet, schedule weeks, player pages) is only reused for `cache_ttl` seconds (`set_cache('raw_cache', new_cache_ttl=60)`) and then downloaded again."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "8b09712e",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "cache_dir = None # None turns the raw response cache off\n",
+    "offline = False\n",
+    "cache_ttl = 60 # seconds a cached response that can still change is reused for\n",
+    "\n",
+    "final_states = ['OFF','FINAL']\n",
+    "game_endpoints = ['play-by-play','boxscore','shiftcharts']\n",
+    "final_games = {} # game_id -> time its first final response was cached\n",
+    "cached_states = {} # (endpoint, game_id) -> (mtime, gameState) of the cached play-by-play or boxscore last read\n",
+    "\n",
+    "\n",
+    "def set_cache(new_cache_dir, new_offline=False, new_cache_ttl=60):\n",
+    "    \n",
+    "    global cache_dir, offline, cache_ttl\n",
+    "    cache_dir = new_cache_dir\n",
+    "    offline = new_offline\n",
+    "    cache_ttl = new_cache_ttl\n",
+    "    final_games.clear()\n",
+    "    cached_states.clear()\n",
+    "    \n",
+    "    \n",
+    "def get_cache_path(cache_key):\n",
+    "    \n",
+    "    endpoint, key = cache_key\n",
+    "    \n",
+    "    return os.path.join(cache_dir, endpoint, '{}.json.gz'.format(key))\n",
+    "\n",
+    "\n",
+    "def read_cached_json(cache_key):\n",
+    "    \n",
+    "    path = get_cache_path(cache_key)\n",
+    "    \n",
+    "    if os.path.exists(path) == False:\n",
+    "        return None\n",
+    "    \n",
+    "    with gzip.open(path, 'rt') as f:\n",
+    "        return json.load(f)\n",
+    "    \n",
+    "    \n",
+    "def write_cached_json(cache_key, data):\n",
+    "    \n",
+    "    path = get_cache_path(cache_key)\n",
+    "    os.makedirs(os.path.dirname(path), exist_ok=True)\n",
+    "    \n",
+    "    tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())\n",
+    "    with gzip.open(tmp_path, 'wt') as f:\n",
+    "        json.dump(data, f)\n",
+    "    os.replace(tmp_path, path)\n",
+    "    \n",
+    "    \n",
+    "def get_final_since(game_id):\n",
+    "    \n",
+    "    # A game is final once its cached play-by-play or boxscore says so. Each file is only read again once it has\n",
+    "    # been rewritten, so polling a game that isn't final doesn't unzip both files every time.\n",
+    "    if game_id not in final_games:\n",
+    "        for endpoint in ['play-by-play','boxscore']:\n",
+    "            path = get_cache_path((endpoint, game_id))\n",
+    "            if os.path.exists(path) == False:\n",
+    "                continue\n",
+    "            mtime = os.path.getmtime(path)\n",
+    "            state = cached_states.get((endpoint, game_id))\n",
+    "            if (state is None) or (state[0] != mtime):\n",
+    "                data = read_cached_json((endpoint, game_id))\n",
+    "                state = (mtime, data.get('gameState'))\n",
+    "                cached_states[(endpoint, game_id)] = state\n",
+    "            if state[1] in final_states:\n",
+    "                final_games[game_id] = min(final_games.get(game_id, float('inf')), mtime)\n",
+    "                \n",
+    "    return final_games.get(game_id)\n",
+    "\n",
+    "\n",
+    "def is_cache_fresh(cache_key, data):\n",
+    "    \n",
+    "    path = get_cache_path(cache_key)\n",
+    "    \n",
+    "    # Responses of a final game cached after it went final never change, anything else is only kept for cache_ttl.\n",
+    "    # The shift chart is often still empty right after the game ends, so an empty one is never kept for good.\n",
+    "    if (cache_key[0] in game_endpoints) and ((cache_key[0] != 'shiftcharts') or (len(data.get('data', [])) > 0)):\n",
+    "        final_since = get_final_since(cache_key[1])\n",
+    "        if (final_since is not None) and (os.path.getmtime(path) >= final_since):\n",
+    "            return True\n",
+    "        \n",
+    "    return time.time() - os.path.getmtime(path) < cache_ttl\n",
+    "    \n",
+    "    \n",
+    "def get_json(url, cache_key=None):\n",
+    "    \n",
+    "    use_cache = (cache_dir is not None) & (cache_key is not None)\n",
+    "    \n",
+    "    if offline == True:\n",
+    "        data = read_cached_json(cache_key) if use_cache else None\n",
+    "        if data is None:\n",
+    "            raise LookupError('{} is not in the raw response cache'.format(url))\n",
+    "        return data\n",
+    "    \n",
+    "    if use_cache == True:\n",
+    "        data = read_cached_json(cache_key)\n",
+    "        if (data is not None) and is_cache_fresh(cache_key, data):\n",
+    "            return data\n",
+    "    \n",
+    "    response = session.get(url, timeout=request_timeout)\n",
+    "    response.raise_for_status()\n",
+    "    data = response.json()\n",
+    "    \n",
+    "    if use_cache == True:\n",
+    "        write_cached_json(cache_key, data)\n",
+    "        mtime = os.path.getmtime(get_cache_path(cache_key))\n",
+    "        if cache_key[0] in ['play-by-play','boxscore']:\n",
+    "            cached_states[cache_key] = (mtime, data.get('gameState'))\n",
+    "        if (cache_key[0] in game_endpoints) and (data.get('gameState') in final_states) and (cache_key[1] not in final_games):\n",
+    "            final_games[cache_key[1]] = mtime\n",
+    "        \n",
+    "    return data"
+   ]
+  },
   {
    "cell_type": "markdown",
    "id": "93f86d16",
@@ -82,48 +291,148 @@
   },
   {
    "cell_type": "code",
-   "execution_count": 3,
-   "id": "f7b5c1ae",
+   "execution_count": null,
+   "id": "970c15c6",
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_away_roster(game_id):\n",
+    "def get_boxscore(game_id):\n",
     "    \n",
-    "    url = 'https://api-web.nhle.com/v1/gamecenter/{}/boxscore'.format(game_id)\n",
+    "    url = '{}/gamecenter/{}/boxscore'.format(api_web_url, game_id)\n",
     "    \n",
     "    try:\n",
-    "        data = requests.get(url)\n",
-    "        boxscore = data.json()\n",
+    "        boxscore = get_json(url, ('boxscore', game_id))\n",
     "        \n",
     "    except Exception as e:\n",
     "        print('URL does not exist for Game_Id {}'.format(game_id))\n",
     "        return None\n",
     "        \n",
     "    else:\n",
-    "        away_roster = {}\n",
-    "        forwards = boxscore.get('playerByGameStats').get('awayTeam').get('forwards')\n",
-    "        defense = boxscore.get('playerByGameStats').get('awayTeam').get('defense')\n",
-    "        goalies = boxscore.get('playerByGameStats').get('awayTeam').get('goalies')\n",
-    "\n",
-    "        for spot in forwards:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            away_roster.update({ spot.get('playerId') : ' '.join([playerInfo.get('firstName').get('default').upper(),playerInfo.get('lastName').get('default').upper()])})\n",
-    "        \n",
-    "        for spot in defense:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            away_roster.update({spot.get('playerId') : ' '.join([playerInfo.get('firstName').get('default').upper(),playerInfo.get('lastName').get('default').upper()])})\n",
-    "        \n",
-    "        for spot in goalies:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            away_roster.update({spot.get('playerId') : ' '.join([playerInfo.get('firstName').get('default').upper(),playerInfo.get('lastName').get('default').upper()])})\n",
+    "        return boxscore"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "83ad64cf",
+   "metadata": {},
+   "source": [
+    "### Player Name Cache\n",
+    "\n",
+    "The boxscore only carries abbreviated names (e.g. `A. Matthews`), so full names used to come from one `/player/{id}/landing` request per dressed player, every game. Names are now resolved in this order:\n",
+    "\n",
+    "1. the roster entry itself, if it carries `firstName`/`lastName` (the play-by-play `rosterSpots` do, and `get_pbp` adds them to the cache),\n",
+    "2. the on-disk player cache at `player_cache_path`,\n",
+    "3. a single landing request, whose result is then saved to the cache.\n",
+    "\n",
+    "A full season scrape therefore makes at most one landing request per player, ever."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "04a53e08",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "player_cache_path = 'player_cache.json'\n",
+    "player_cache = None\n",
+    "player_cache_lock = threading.RLock() # games can be scraped from several threads at once\n",
+    "\n",
+    "\n",
+    "def load_player_cache():\n",
+    "    \n",
+    "    global player_cache\n",
+    "    \n",
+    "    with player_cache_lock:\n",
+    "        if player_cache is None:\n",
+    "            player_cache = {}\n",
+    "            if os.path.exists(player_cache_path):\n",
+    "                with open(player_cache_path) as f:\n",
+    "                    player_cache = {int(player_id) : info for player_id, info in json.load(f).items()}\n",
     "                \n",
-    "        return away_roster"
+    "    return player_cache\n",
+    "\n",
+    "\n",
+    "def save_player_cache():\n",
+    "    \n",
+    "    with player_cache_lock:\n",
+    "        tmp_path = player_cache_path + '.tmp'\n",
+    "        with open(tmp_path, 'w') as f:\n",
+    "            json.dump(load_player_cache(), f)\n",
+    "        os.replace(tmp_path, player_cache_path)\n",
+    "\n",
+    "\n",
+    "def update_player_cache(spots):\n",
+    "    \n",
+    "    cache = load_player_cache()\n",
+    "    updated = False\n",
+    "    \n",
+    "    with player_cache_lock:\n",
+    "        for spot in spots:\n",
+    "            if ('firstName' in spot.keys()) & ('lastName' in spot.keys()) & (spot.get('playerId') not in cache):\n",
+    "                cache[spot.get('playerId')] = {'firstName' : spot['firstName']['default'],\n",
+    "                                               'lastName' : spot['lastName']['default'],\n",
+    "                                               'position' : spot.get('positionCode', spot.get('position'))}\n",
+    "                updated = True\n",
+    "            \n",
+    "        if updated == True:\n",
+    "            save_player_cache()\n",
+    "\n",
+    "\n",
+    "def get_player_info(spot):\n",
+    "    \n",
+    "    cache = load_player_cache()\n",
+    "    player_id = spot.get('playerId')\n",
+    "    \n",
+    "    if player_id not in cache:\n",
+    "        update_player_cache([spot])\n",
+    "        \n",
+    "    if player_id not in cache:\n",
+    "        url = '{}/player/{}/landing'.format(api_web_url, player_id)\n",
+    "        playerInfo = get_json(url, ('landing', player_id))\n",
+    "        playerInfo['playerId'] = player_id\n",
+    "        update_player_cache([playerInfo])\n",
+    "        \n",
+    "    return cache[player_id]\n",
+    "\n",
+    "\n",
+    "def get_player_name(spot):\n",
+    "    \n",
+    "    playerInfo = get_player_info(spot)\n",
+    "    \n",
+    "    return ' '.join([playerInfo.get('firstName').upper(),playerInfo.get('lastName').upper()])"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": 3,
+   "id": "f7b5c1ae",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def get_away_roster(game_id, boxscore=None):\n",
+    "    \n",
+    "    if boxscore is None:\n",
+    "        boxscore = get_boxscore(game_id)\n",
+    "        \n",
+    "    if boxscore is None:\n",
+    "        return None\n",
+    "        \n",
+    "    away_roster = {}\n",
+    "    forwards = boxscore.get('playerByGameStats').get('awayTeam').get('forwards')\n",
+    "    defense = boxscore.get('playerByGameStats').get('awayTeam').get('defense')\n",
+    "    goalies = boxscore.get('playerByGameStats').get('awayTeam').get('goalies')\n",
+    "\n",
+    "    for spot in forwards:\n",
+    "        away_roster.update({spot.get('playerId') : get_player_name(spot)})\n",
+    "    \n",
+    "    for spot in defense:\n",
+    "        away_roster.update({spot.get('playerId') : get_player_name(spot)})\n",
+    "    \n",
+    "    for spot in goalies:\n",
+    "        away_roster.update({spot.get('playerId') : get_player_name(spot)})\n",
+    "            \n",
+    "    return away_roster"
    ]
   },
   {
@@ -144,43 +453,29 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_home_roster(game_id):\n",
+    "def get_home_roster(game_id, boxscore=None):\n",
     "    \n",
-    "    url = 'https://api-web.nhle.com/v1/gamecenter/{}/boxscore'.format(game_id)\n",
-    "    \n",
-    "    try:\n",
-    "        data = requests.get(url)\n",
-    "        boxscore = data.json()\n",
+    "    if boxscore is None:\n",
+    "        boxscore = get_boxscore(game_id)\n",
     "        \n",
-    "    except Exception as e:\n",
-    "        print('URL does not exist for Game_Id {}'.format(game_id))\n",
+    "    if boxscore is None:\n",
     "        return None\n",
     "        \n",
-    "    else:\n",
-    "        home_roster = {}\n",
-    "        forwards = boxscore.get('playerByGameStats').get('homeTeam').get('forwards')\n",
-    "        defense = boxscore.get('playerByGameStats').get('homeTeam').get('defense')\n",
-    "        goalies = boxscore.get('playerByGameStats').get('homeTeam').get('goalies')\n",
-    "\n",
-    "        for spot in forwards:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            home_roster.update({ spot.get('playerId') : ' '.join([playerInfo.get('firstName').get('default').upper(),playerInfo.get('lastName').get('default').upper()])})\n",
-    "        \n",
-    "        for spot in defense:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            home_roster.update({ spot.get('playerId') : ' '.join([playerInfo.get('firstName').get('default').upper(),playerInfo.get('lastName').get('default').upper()])})\n",
-    "        \n",
-    "        for spot in goalies:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            home_roster.update({ spot.get('playerId') : ' '.join([playerInfo.get('firstName').get('default').upper(),playerInfo.get('lastName').get('default').upper()])})\n",
-    "                \n",
-    "        return home_roster"
+    "    home_roster = {}\n",
+    "    forwards = boxscore.get('playerByGameStats').get('homeTeam').get('forwards')\n",
+    "    defense = boxscore.get('playerByGameStats').get('homeTeam').get('defense')\n",
+    "    goalies = boxscore.get('playerByGameStats').get('homeTeam').get('goalies')\n",
+    "\n",
+    "    for spot in forwards:\n",
+    "        home_roster.update({spot.get('playerId') : get_player_name(spot)})\n",
+    "    \n",
+    "    for spot in defense:\n",
+    "        home_roster.update({spot.get('playerId') : get_player_name(spot)})\n",
+    "    \n",
+    "    for spot in goalies:\n",
+    "        home_roster.update({spot.get('playerId') : get_player_name(spot)})\n",
+    "            \n",
+    "    return home_roster"
    ]
   },
   {
@@ -201,10 +496,16 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_game_roster(game_id):\n",
+    "def get_game_roster(game_id, boxscore=None):\n",
     "    \n",
-    "    away_roster = get_away_roster(game_id)\n",
-    "    home_roster = get_home_roster(game_id)\n",
+    "    if boxscore is None:\n",
+    "        boxscore = get_boxscore(game_id)\n",
+    "        \n",
+    "    if boxscore is None:\n",
+    "        return None\n",
+    "    \n",
+    "    away_roster = get_away_roster(game_id, boxscore)\n",
+    "    home_roster = get_home_roster(game_id, boxscore)\n",
     "    \n",
     "    game_roster = away_roster.update(home_roster)\n",
     "    \n",
@@ -241,43 +542,29 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_away_positions(game_id):\n",
-    "    \n",
-    "    url = 'https://api-web.nhle.com/v1/gamecenter/{}/boxscore'.format(game_id)\n",
+    "def get_away_positions(game_id, boxscore=None):\n",
     "    \n",
-    "    try:\n",
-    "        data = requests.get(url)\n",
-    "        boxscore = data.json()\n",
+    "    if boxscore is None:\n",
+    "        boxscore = get_boxscore(game_id)\n",
     "        \n",
-    "    except Exception as e:\n",
-    "        print('URL does not exist for Game_Id {}'.format(game_id))\n",
+    "    if boxscore is None:\n",
     "        return None\n",
     "        \n",
-    "    else:\n",
-    "        away_roster = {}\n",
-    "        forwards = boxscore.get('playerByGameStats').get('awayTeam').get('forwards')\n",
-    "        defense = boxscore.get('playerByGameStats').get('awayTeam').get('defense')\n",
-    "        goalies = boxscore.get('playerByGameStats').get('awayTeam').get('goalies')\n",
-    "\n",
-    "        for spot in forwards:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            away_roster.update({ spot.get('playerId') : 'F'})\n",
-    "        \n",
-    "        for spot in defense:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            away_roster.update({spot.get('playerId') : 'D'})\n",
-    "        \n",
-    "        for spot in goalies:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            away_roster.update({spot.get('playerId') : 'G'})\n",
-    "                \n",
-    "        return away_roster"
+    "    away_roster = {}\n",
+    "    forwards = boxscore.get('playerByGameStats').get('awayTeam').get('forwards')\n",
+    "    defense = boxscore.get('playerByGameStats').get('awayTeam').get('defense')\n",
+    "    goalies = boxscore.get('playerByGameStats').get('awayTeam').get('goalies')\n",
+    "\n",
+    "    for spot in forwards:\n",
+    "        away_roster.update({spot.get('playerId') : 'F'})\n",
+    "    \n",
+    "    for spot in defense:\n",
+    "        away_roster.update({spot.get('playerId') : 'D'})\n",
+    "    \n",
+    "    for spot in goalies:\n",
+    "        away_roster.update({spot.get('playerId') : 'G'})\n",
+    "            \n",
+    "    return away_roster"
    ]
   },
   {
@@ -298,43 +585,29 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_home_positions(game_id):\n",
+    "def get_home_positions(game_id, boxscore=None):\n",
     "    \n",
-    "    url = 'https://api-web.nhle.com/v1/gamecenter/{}/boxscore'.format(game_id)\n",
-    "    \n",
-    "    try:\n",
-    "        data = requests.get(url)\n",
-    "        boxscore = data.json()\n",
+    "    if boxscore is None:\n",
+    "        boxscore = get_boxscore(game_id)\n",
     "        \n",
-    "    except Exception as e:\n",
-    "        print('URL does not exist for Game_Id {}'.format(game_id))\n",
+    "    if boxscore is None:\n",
     "        return None\n",
     "        \n",
-    "    else:\n",
-    "        home_roster = {}\n",
-    "        forwards = boxscore.get('playerByGameStats').get('homeTeam').get('forwards')\n",
-    "        defense = boxscore.get('playerByGameStats').get('homeTeam').get('defense')\n",
-    "        goalies = boxscore.get('playerByGameStats').get('homeTeam').get('goalies')\n",
-    "\n",
-    "        for spot in forwards:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            home_roster.update({ spot.get('playerId') : 'F'})\n",
-    "        \n",
-    "        for spot in defense:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            home_roster.update({spot.get('playerId') : 'D'})\n",
-    "        \n",
-    "        for spot in goalies:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            home_roster.update({spot.get('playerId') : 'G'})\n",
-    "                \n",
-    "        return home_roster"
+    "    home_roster = {}\n",
+    "    forwards = boxscore.get('playerByGameStats').get('homeTeam').get('forwards')\n",
+    "    defense = boxscore.get('playerByGameStats').get('homeTeam').get('defense')\n",
+    "    goalies = boxscore.get('playerByGameStats').get('homeTeam').get('goalies')\n",
+    "\n",
+    "    for spot in forwards:\n",
+    "        home_roster.update({spot.get('playerId') : 'F'})\n",
+    "    \n",
+    "    for spot in defense:\n",
+    "        home_roster.update({spot.get('playerId') : 'D'})\n",
+    "    \n",
+    "    for spot in goalies:\n",
+    "        home_roster.update({spot.get('playerId') : 'G'})\n",
+    "            \n",
+    "    return home_roster"
    ]
   },
   {
@@ -355,10 +628,16 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_game_positions(game_id):\n",
+    "def get_game_positions(game_id, boxscore=None):\n",
     "    \n",
-    "    away_positions = get_away_positions(game_id)\n",
-    "    home_positions = get_home_positions(game_id)\n",
+    "    if boxscore is None:\n",
+    "        boxscore = get_boxscore(game_id)\n",
+    "        \n",
+    "    if boxscore is None:\n",
+    "        return None\n",
+    "    \n",
+    "    away_positions = get_away_positions(game_id, boxscore)\n",
+    "    home_positions = get_home_positions(game_id, boxscore)\n",
     "    \n",
     "    game_positions = away_positions.update(home_positions)\n",
     "    \n",
@@ -393,36 +672,25 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_goalies_id(game_id):\n",
-    "    \n",
-    "    url = 'https://api-web.nhle.com/v1/gamecenter/{}/boxscore'.format(game_id)\n",
+    "def get_goalies_id(game_id, boxscore=None):\n",
     "    \n",
-    "    try:\n",
-    "        data = requests.get(url)\n",
-    "        boxscore = data.json()\n",
+    "    if boxscore is None:\n",
+    "        boxscore = get_boxscore(game_id)\n",
     "        \n",
-    "    except Exception as e:\n",
-    "        print('URL does not exist for Game_Id {}'.format(game_id))\n",
+    "    if boxscore is None:\n",
     "        return None\n",
     "        \n",
-    "    else:\n",
-    "        goalies = {}\n",
-    "        away_goalies = boxscore.get('playerByGameStats').get('awayTeam').get('goalies')\n",
-    "        home_goalies = boxscore.get('playerByGameStats').get('homeTeam').get('goalies')\n",
-    "        \n",
-    "        for spot in away_goalies:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            goalies.update({ spot.get('playerId') : ' '.join([playerInfo.get('firstName').get('default').upper(),playerInfo.get('lastName').get('default').upper()])})\n",
+    "    goalies = {}\n",
+    "    away_goalies = boxscore.get('playerByGameStats').get('awayTeam').get('goalies')\n",
+    "    home_goalies = boxscore.get('playerByGameStats').get('homeTeam').get('goalies')\n",
+    "    \n",
+    "    for spot in away_goalies:\n",
+    "        goalies.update({spot.get('playerId') : get_player_name(spot)})\n",
+    "        \n",
+    "    for spot in home_goalies:\n",
+    "        goalies.update({spot.get('playerId') : get_player_name(spot)})\n",
     "            \n",
-    "        for spot in home_goalies:\n",
-    "            url = 'https://api-web.nhle.com/v1/player/{}/landing'.format(spot.get('playerId'))\n",
-    "            playerInfo = requests.get(url)\n",
-    "            playerInfo = playerInfo.json()\n",
-    "            goalies.update({ spot.get('playerId') : ' '.join([playerInfo.get('firstName').get('default').upper(),playerInfo.get('lastName').get('default').upper()])})\n",
-    "                \n",
-    "        return goalies"
+    "    return goalies"
    ]
   },
   {
@@ -481,6 +749,48 @@
     "              59 : 'UTA'}"
    ]
   },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "fa105b47",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# For each typeCode, the details fields to pull out, in the order they are applied:\n",
+    "# (details key that must be present, event column, extractor taking the details dict or None to copy the key's value,\n",
+    "#  whether it sets Ev_Team)\n",
+    "\n",
+    "def get_penalty_type(details):\n",
+    "    if details['typeCode'].upper() == 'PS':\n",
+    "        return ' '.join([details['typeCode'].upper(),'for',details['descKey'][3:].upper()])\n",
+    "    else:\n",
+    "        return ' '.join([str(details['duration']),'minute',details['typeCode'],'for',details['descKey'].upper()])\n",
+    "\n",
+    "shotFields = [('scoringPlayerId', 'p1_ID', None, True),\n",
+    "              ('shootingPlayerId', 'p1_ID', None, True),\n",
+    "              ('assist1PlayerId', 'p2_ID', None, False),\n",
+    "              ('assist2PlayerId', 'p3_ID', None, False),\n",
+    "              ('blockingPlayerId', 'p2_ID', None, True),\n",
+    "              ('shotType', 'Type', lambda details: details['shotType'].upper(), False),\n",
+    "              ('homeScore', 'Home_Score', None, False),\n",
+    "              ('homeScore', 'Away_Score', lambda details: details['awayScore'], False)]\n",
+    "\n",
+    "eventFields = {502 : [('winningPlayerId', 'p1_ID', None, True),\n",
+    "                      ('losingPlayerId', 'p2_ID', None, False)],\n",
+    "               503 : [('hittingPlayerId', 'p1_ID', None, True),\n",
+    "                      ('hitteePlayerId', 'p2_ID', None, False)],\n",
+    "               504 : [('playerId', 'p1_ID', None, True)],\n",
+    "               505 : shotFields,\n",
+    "               506 : shotFields,\n",
+    "               507 : shotFields,\n",
+    "               508 : shotFields,\n",
+    "               509 : [('committedByPlayerId', 'p1_ID', None, True),\n",
+    "                      ('drawnByPlayerId', 'p2_ID', None, False),\n",
+    "                      ('descKey', 'Type', get_penalty_type, False)],\n",
+    "               525 : [('playerId', 'p1_ID', None, True)],\n",
+    "               535 : [('eventOwnerTeamId', 'Ev_Team', lambda details: teamCodes.get(int(details['eventOwnerTeamId'])), False)]}"
+   ]
+  },
   {
    "cell_type": "markdown",
    "id": "19e02e65",
@@ -498,37 +808,212 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def parse_event(play_dict):\n",
+    "def time_to_seconds(time_str):\n",
     "    \n",
-    "    event_dict_keys = ['Period','Event_tc','Event','Time_Remaining','Time_Elapsed','Strength','Ev_Zone','Type','Ev_Team',\n",
-    "                       'p1_name','p1_ID','p2_name','p2_ID','p3_name','p3_ID','xC','yC']\n",
+    "    minutes, seconds = time_str.split(':')\n",
     "    \n",
-    "    event_dict = dict()\n",
+    "    return int(minutes)*60 + int(seconds)\n",
+    "\n",
+    "\n",
+    "def get_game_seconds(period, seconds):\n",
     "    \n",
-    "    # Common play items across all plays\n",
-    "    event_dict['Period'] = play_dict['periodDescriptor']['number']\n",
-    "    event_dict['Event_tc'] = play_dict['typeCode']\n",
-    "    event_dict['Event'] = play_dict['typeDescKey'].upper()\n",
-    "    event_dict['Time_Remaining'] = play_dict['timeRemaining']\n",
-    "    event_dict['Time_Elapsed'] = play_dict['timeInPeriod']\n",
-    "    if 'situationCode' in play_dict.keys():\n",
-    "        event_dict['Strength'] = str(play_dict['situationCode'])\n",
-    "    else:\n",
-    "        event_dict['Strength'] = '1551'\n",
-    "    event_dict['sortOrder'] = play_dict['sortOrder']\n",
+    "    return (period - 1)*1200 + seconds"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "a398eb26",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# Every play of a game is written straight into preallocated typed arrays and the DataFrame is built from those,\n",
+    "# instead of pandas working out the columns and dtypes from a list of dicts.\n",
+    "\n",
+    "eventColumns = {'Period' : np.int32, 'Event_tc' : np.int32, 'sortOrder' : np.int32, 'Seconds_Elapsed' : np.int32,\n",
+    "                'Game_Seconds' : np.int32, 'xC' : np.float32, 'yC' : np.float32, 'p1_ID' : np.int64, 'p2_ID' : np.int64,\n",
+    "                'p3_ID' : np.int64, 'Home_Score' : np.int16, 'Away_Score' : np.int16, 'Event' : object,\n",
+    "                'Time_Remaining' : object, 'Time_Elapsed' : object, 'Strength' : object, 'Ev_Zone' : object,\n",
+    "                'Type' : object, 'Ev_Team' : object}\n",
+    "\n",
+    "null_value = -1 # stands in for a missing player ID or score until the frame is built\n",
+    "\n",
+    "\n",
+    "def parse_events(plays):\n",
+    "\n",
+    "    n = len(plays)\n",
+    "    cols = {}\n",
+    "\n",
+    "    for col, dtype in eventColumns.items():\n",
+    "        if dtype == np.float32:\n",
+    "            cols[col] = np.full(n, np.nan, dtype=dtype)\n",
+    "        elif dtype == object:\n",
+    "            cols[col] = np.full(n, None, dtype=dtype)\n",
+    "        else:\n",
+    "            cols[col] = np.full(n, null_value, dtype=dtype)\n",
+    "\n",
+    "    Period, Event_tc, sortOrder = cols['Period'], cols['Event_tc'], cols['sortOrder']\n",
+    "    Seconds_Elapsed, Game_Seconds = cols['Seconds_Elapsed'], cols['Game_Seconds']\n",
+    "    Event, Time_Remaining, Time_Elapsed, Strength = cols['Event'], cols['Time_Remaining'], cols['Time_Elapsed'], cols['Strength']\n",
+    "    Ev_Zone, Ev_Team, xC, yC = cols['Ev_Zone'], cols['Ev_Team'], cols['xC'], cols['yC']\n",
+    "\n",
+    "    for i, play_dict in enumerate(plays):\n",
+    "\n",
+    "        # Common play items across all plays\n",
+    "        period = play_dict['periodDescriptor']['number']\n",
+    "        seconds = time_to_seconds(play_dict['timeInPeriod'])\n",
+    "        Period[i] = period\n",
+    "        Event_tc[i] = play_dict['typeCode']\n",
+    "        Event[i] = play_dict['typeDescKey'].upper()\n",
+    "        Time_Remaining[i] = play_dict['timeRemaining']\n",
+    "        Time_Elapsed[i] = play_dict['timeInPeriod']\n",
+    "        Seconds_Elapsed[i] = seconds\n",
+    "        Game_Seconds[i] = get_game_seconds(period, seconds)\n",
+    "        Strength[i] = str(play_dict.get('situationCode', '1551'))\n",
+    "        sortOrder[i] = play_dict['sortOrder']\n",
+    "\n",
+    "        details = play_dict.get('details')\n",
+    "        if details is not None:\n",
+    "\n",
+    "            if 'zoneCode' in details:\n",
+    "                Ev_Zone[i] = details['zoneCode']\n",
+    "            if 'xCoord' in details:\n",
+    "                xC[i] = details['xCoord']\n",
+    "                yC[i] = details['yCoord']\n",
+    "\n",
+    "            for key, col, extract, sets_team in eventFields.get(play_dict['typeCode'], []):\n",
+    "                if key in details:\n",
+    "                    cols[col][i] = details[key] if extract is None else extract(details)\n",
+    "                    if sets_team == True:\n",
+    "                        Ev_Team[i] = teamCodes.get(int(details['eventOwnerTeamId']))\n",
+    "\n",
+    "    # Player IDs and scores become nullable integer columns, with the placeholder values masked out\n",
+    "    for col, dtype in eventColumns.items():\n",
+    "        if dtype in [np.int64, np.int16]:\n",
+    "            cols[col] = pd.arrays.IntegerArray(cols[col], cols[col] == null_value)\n",
+    "\n",
+    "    return pd.DataFrame(cols)"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": 20,
+   "id": "f556bef7",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def get_pbp(game_id, boxscore=None, pbp_data=None):\n",
     "    \n",
-    "      \n",
-    "    # Below is applicable for FACEOFF, HIT, GIVEAWAY, GOAL, SHOT_ON_GOAL, MISSED_SHOT, BLOCKED_SHOT, PENALTY, TAKEAWAY, DELAYED_PENALTY    \n",
-    "    if 'details' in play_dict.keys(): \n",
-    "        if 'zoneCode' in play_dict['details'].keys():\n",
-    "            event_dict['Ev_Zone'] = play_dict['details']['zoneCode']\n",
-    "        if 'xCoord' in play_dict['details'].keys():\n",
-    "            event_dict['xC'] = play_dict['details']['xCoord']\n",
-    "            event_dict['yC'] = play_dict['details']['yCoord']\n",
+    "    url = '{}/gamecenter/{}/play-by-play'.format(api_web_url, game_id)\n",
+    "    \n",
+    "    try:\n",
+    "        if pbp_data is None:\n",
+    "            pbp_data = get_json(url, ('play-by-play', game_id))\n",
+    "        update_player_cache(pbp_data.get('rosterSpots', []))\n",
+    "        roster = get_game_roster(game_id, boxscore)\n",
+    "    \n",
+    "    except Exception as e:\n",
+    "        print('Unable to get play-by-play for Game_Id {}'.format(game_id))\n",
+    "        return None\n",
     "        \n",
-    "        if event_dict['Event_tc'] == 502: # Faceoffs\n",
-    "            if 'winningPlayerId' in play_dict['details'].keys():\n",
-    "                event_dict['p1_ID'] = play_dict['details']['winningPlayerId']\n",
+    "    else:\n",
+    "        plays = pbp_data['plays']\n",
+    "        pbp_df = parse_events(plays)\n",
+    "        \n",
+    "        pbp_df['Away_Team'] = pbp_data['awayTeam']['abbrev']\n",
+    "        pbp_df['Home_Team'] = pbp_data['homeTeam']['abbrev']\n",
+    "        pbp_df['Game_Id'] = game_id\n",
+    "        \n",
+    "        pbp_df = pbp_df.sort_values(by='sortOrder',ascending=True).reset_index(drop=True)\n",
+    "        \n",
+    "        pbp_df['p1_name'] = pbp_df['p1_ID'].map(roster)\n",
+    "        pbp_df['p2_name'] = pbp_df['p2_ID'].map(roster)\n",
+    "        pbp_df['p3_name'] = pbp_df['p3_ID'].map(roster)\n",
+    "        \n",
+    "        # Only goals carry a score, every other event keeps the score of the event before it\n",
+    "        is_goal = pbp_df['Event_tc'] == 505\n",
+    "        for col in ['Home_Score','Away_Score']:\n",
+    "            pbp_df[col] = pbp_df[col].where(is_goal).ffill().fillna(0)\n",
+    "            \n",
+    "        pbp_df['Home_Skaters'] = pd.to_numeric(pbp_df['Strength'].str[2], errors='coerce')\n",
+    "        pbp_df['Away_Skaters'] = pd.to_numeric(pbp_df['Strength'].str[1], errors='coerce')\n",
+    "                    \n",
+    "        return pbp_df[['Game_Id','Period','Event_tc','Event','Time_Remaining','Time_Elapsed','Seconds_Elapsed','Game_Seconds',\n",
+    "                       'Strength','Type','p1_ID','p1_name','Ev_Team','p2_ID','p2_name','p3_ID','p3_name','Ev_Zone','xC', 'yC',\n",
+    "                       'Home_Skaters','Away_Skaters','Home_Score','Away_Score','Away_Team','Home_Team','sortOrder']]"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": 21,
+   "id": "3c9f9899",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "# pbp = get_pbp(2023020005)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "f29b6819",
+   "metadata": {},
+   "source": [
+    "### Benchmarking `parse_events`\n",
+    "\n",
+    "`parse_events` looks up the fields to extract for each play's `typeCode` in `eventFields` once, instead of testing every type in turn, and writes them straight into typed column arrays. `benchmark_parse_events` reports events/second for any parser that takes a list of plays, over every play-by-play in the raw response cache, so changes to the parser can be compared on a recorded season. `baseline_parse_events` is a frozen copy of the parser from before `eventFields` (one dict per play with a chain of `typeCode` checks, then `pd.DataFrame` of the dicts), so the before and after figures can both be measured on the same plays."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "8dc642a4",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def load_cached_plays():\n",
+    "    \n",
+    "    plays = []\n",
+    "    \n",
+    "    for path in sorted(glob.glob(os.path.join(cache_dir, 'play-by-play', '*.json.gz'))):\n",
+    "        with gzip.open(path, 'rt') as f:\n",
+    "            plays.extend(json.load(f)['plays'])\n",
+    "            \n",
+    "    return plays\n",
+    "\n",
+    "\n",
+    "# Frozen copy of parse_event as it was before eventFields and parse_events, kept only as the baseline of the benchmark.\n",
+    "# The scraper doesn't use it, so it isn't updated when the parsing changes.\n",
+    "def baseline_parse_event(play_dict):\n",
+    "    \n",
+    "    event_dict = dict()\n",
+    "    \n",
+    "    # Common play items across all plays\n",
+    "    event_dict['Period'] = play_dict['periodDescriptor']['number']\n",
+    "    event_dict['Event_tc'] = play_dict['typeCode']\n",
+    "    event_dict['Event'] = play_dict['typeDescKey'].upper()\n",
+    "    event_dict['Time_Remaining'] = play_dict['timeRemaining']\n",
+    "    event_dict['Time_Elapsed'] = play_dict['timeInPeriod']\n",
+    "    event_dict['Seconds_Elapsed'] = time_to_seconds(play_dict['timeInPeriod'])\n",
+    "    event_dict['Game_Seconds'] = get_game_seconds(event_dict['Period'], event_dict['Seconds_Elapsed'])\n",
+    "    if 'situationCode' in play_dict.keys():\n",
+    "        event_dict['Strength'] = str(play_dict['situationCode'])\n",
+    "    else:\n",
+    "        event_dict['Strength'] = '1551'\n",
+    "    event_dict['sortOrder'] = play_dict['sortOrder']\n",
+    "    \n",
+    "      \n",
+    "    # Below is applicable for FACEOFF, HIT, GIVEAWAY, GOAL, SHOT_ON_GOAL, MISSED_SHOT, BLOCKED_SHOT, PENALTY, TAKEAWAY, DELAYED_PENALTY    \n",
+    "    if 'details' in play_dict.keys(): \n",
+    "        if 'zoneCode' in play_dict['details'].keys():\n",
+    "            event_dict['Ev_Zone'] = play_dict['details']['zoneCode']\n",
+    "        if 'xCoord' in play_dict['details'].keys():\n",
+    "            event_dict['xC'] = play_dict['details']['xCoord']\n",
+    "            event_dict['yC'] = play_dict['details']['yCoord']\n",
+    "        \n",
+    "        if event_dict['Event_tc'] == 502: # Faceoffs\n",
+    "            if 'winningPlayerId' in play_dict['details'].keys():\n",
+    "                event_dict['p1_ID'] = play_dict['details']['winningPlayerId']\n",
     "                event_dict['Ev_Team'] = teamCodes.get(int(play_dict['details']['eventOwnerTeamId']))\n",
     "            if 'losingPlayerId' in play_dict['details'].keys():\n",
     "                event_dict['p2_ID'] = play_dict['details']['losingPlayerId']\n",
@@ -588,79 +1073,40 @@
     "            \n",
     "        # Failed_Shot_Attempts?\n",
     "        \n",
-    "    return event_dict"
-   ]
-  },
-  {
-   "cell_type": "code",
-   "execution_count": 20,
-   "id": "f556bef7",
-   "metadata": {},
-   "outputs": [],
-   "source": [
-    "def get_pbp(game_id):\n",
+    "    return event_dict\n",
+    "\n",
+    "\n",
+    "def baseline_parse_events(plays):\n",
     "    \n",
-    "    url = 'https://api-web.nhle.com/v1/gamecenter/{}/play-by-play'.format(game_id)\n",
+    "    return pd.DataFrame([baseline_parse_event(play) for play in plays])\n",
+    "\n",
+    "\n",
+    "def benchmark_parse_events(plays, parser=parse_events, repeat=5):\n",
     "    \n",
-    "    try:\n",
-    "        pbp = requests.get('https://api-web.nhle.com/v1/gamecenter/'+str(game_id)+'/play-by-play')\n",
-    "        pbp_data = pbp.json()\n",
-    "        roster = get_game_roster(game_id)\n",
+    "    best = None\n",
     "    \n",
-    "    except Exception as e:\n",
-    "        print('Unable to get play-by-play for Game_Id {}'.format(game_id))\n",
-    "        return None\n",
-    "        \n",
-    "    else:\n",
-    "        plays = pbp_data['plays']\n",
-    "        events = [parse_event(play) for play in plays]\n",
-    "        pbp_df = pd.DataFrame(events)\n",
-    "        \n",
-    "        pbp_df['Away_Team'] = pbp_data['awayTeam']['abbrev']\n",
-    "        pbp_df['Home_Team'] = pbp_data['homeTeam']['abbrev']\n",
-    "        pbp_df['p1_name'] = None\n",
-    "        pbp_df['p2_name'] = None\n",
-    "        pbp_df['p3_name'] = np.nan\n",
-    "        pbp_df['Game_Id'] = game_id\n",
-    "        \n",
-    "        pbp_df = pbp_df.sort_values(by='sortOrder',ascending=True).reset_index(drop=True)\n",
-    "        \n",
-    "        for i in pbp_df.index:\n",
-    "            if pd.isna(pbp_df.at[i,'p1_ID']) == False:\n",
-    "                if pd.isna(pbp_df.at[i,'p1_name']) == True:\n",
-    "                    pbp_df.at[i,'p1_name'] = roster.get(pbp_df.at[i,'p1_ID'])\n",
-    "            if pd.isna(pbp_df.at[i,'p2_ID']) == False:\n",
-    "                if pd.isna(pbp_df.at[i,'p2_name']) == True:\n",
-    "                    pbp_df.at[i,'p2_name'] = roster.get(pbp_df.at[i,'p2_ID'])\n",
-    "            if pd.isna(pbp_df.at[i,'p3_ID']) == False:\n",
-    "                if pd.isna(pbp_df.at[i,'p3_name']) == True:\n",
-    "                    pbp_df.at[i,'p3_name'] = roster.get(pbp_df.at[i,'p3_ID'])\n",
+    "    for i in range(repeat):\n",
+    "        start = time.perf_counter()\n",
+    "        parser(plays)\n",
+    "        elapsed = time.perf_counter() - start\n",
+    "        if (best is None) or (elapsed < best):\n",
+    "            best = elapsed\n",
     "            \n",
-    "            if i == 0:\n",
-    "                pbp_df.at[i,'Home_Score'] = 0\n",
-    "                pbp_df.at[i,'Away_Score'] = 0\n",
-    "            else:\n",
-    "                if pbp_df.at[i,'Event_tc'] != 505:\n",
-    "                    pbp_df.at[i,'Home_Score'] = pbp_df.at[i-1,'Home_Score']\n",
-    "                    pbp_df.at[i,'Away_Score'] = pbp_df.at[i-1,'Away_Score']\n",
-    "                    \n",
-    "            pbp_df.at[i,'Home_Skaters'] = pbp_df.at[i,'Strength'][2]\n",
-    "            pbp_df.at[i,'Away_Skaters'] = pbp_df.at[i,'Strength'][1]\n",
-    "                    \n",
-    "        return pbp_df[['Game_Id','Period','Event_tc','Event','Time_Remaining','Time_Elapsed','Strength','Type','p1_ID',\n",
-    "                       'p1_name','Ev_Team','p2_ID','p2_name','p3_ID','p3_name','Ev_Zone','xC', 'yC','Home_Skaters',\n",
-    "                       'Away_Skaters','Home_Score','Away_Score','Away_Team','Home_Team','sortOrder']]"
+    "    return len(plays) / best"
    ]
   },
   {
    "cell_type": "code",
-   "execution_count": 21,
-   "id": "3c9f9899",
+   "execution_count": null,
+   "id": "4941a88d",
    "metadata": {},
    "outputs": [],
    "source": [
-    "# %%time\n",
-    "# pbp = get_pbp(2023020005)"
+    "# Testing\n",
+    "# set_cache('raw_cache', True)\n",
+    "# plays = load_cached_plays()\n",
+    "# print('before: {:,.0f} events/second over {:,} plays'.format(benchmark_parse_events(plays, baseline_parse_events), len(plays)))\n",
+    "# print('after: {:,.0f} events/second over {:,} plays'.format(benchmark_parse_events(plays), len(plays)))"
    ]
   },
   {
@@ -691,10 +1137,16 @@
     "    shift_info['team'] = teamCodes.get(shift['teamId'])\n",
     "    shift_info['period'] = shift['period']\n",
     "    shift_info['start'] = shift['startTime']\n",
-    "    if shift['endTime'] == '':\n",
+    "    shift_info['start_seconds'] = time_to_seconds(shift['startTime'])\n",
+    "    shift_info['game_start_seconds'] = get_game_seconds(shift['period'], shift_info['start_seconds'])\n",
+    "    if shift['endTime'] in ['', None]:\n",
     "        shift_info['end'] = None\n",
+    "        shift_info['end_seconds'] = None\n",
+    "        shift_info['game_end_seconds'] = None\n",
     "    else:\n",
-    "        shift_info['end'] = shift['endTime']    \n",
+    "        shift_info['end'] = shift['endTime']\n",
+    "        shift_info['end_seconds'] = time_to_seconds(shift['endTime'])\n",
+    "        shift_info['game_end_seconds'] = get_game_seconds(shift['period'], shift_info['end_seconds'])\n",
     "    \n",
     "    return shift_info"
    ]
@@ -706,20 +1158,21 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_shifts(game_id):\n",
+    "def get_shifts(game_id, shift_data=None):\n",
     "    \n",
     "    try:\n",
-    "        url = 'https://api.nhle.com/stats/rest/en/shiftcharts?cayenneExp=gameId={}'.format(game_id)\n",
-    "        data = requests.get(url)\n",
-    "        shifts = data.json()\n",
+    "        url = '{}/shiftcharts?cayenneExp=gameId={}'.format(api_stats_url, game_id)\n",
+    "        if shift_data is None:\n",
+    "            shift_data = get_json(url, ('shiftcharts', game_id))\n",
     "        \n",
     "    except Exception as e:\n",
     "        print('Unable to get shifts for Game_Id {}'.format(game_id))\n",
     "        return None\n",
     "    \n",
     "    else:\n",
-    "        shift_df = [parse_shifts(shift) for shift in shifts.get('data')]\n",
+    "        shift_df = [parse_shifts(shift) for shift in shift_data.get('data')]\n",
     "        shift_df = pd.DataFrame(shift_df)\n",
+    "        shift_df.insert(0, 'Game_Id', game_id)\n",
     "        \n",
     "        return shift_df"
    ]
@@ -786,142 +1239,1720 @@
   },
   {
    "cell_type": "markdown",
-   "id": "e40f802c",
+   "id": "fcc7d90d",
    "metadata": {},
    "source": [
     "<br>\n",
     "\n",
-    "### Getting Combined Play-By-Play with Shift Data"
+    "### Matching Shifts to Events\n",
+    "\n",
+    "Checking every shift against every event was by far the slowest part of the scraper (roughly 800 shifts x 350 events per game). Instead, the shifts and events of each period are both sorted by time and swept through together: a shift joins the active list once its start is reached and drops out once its end has passed, so each event only has to run `check_if_on_ice_conditions_met` against the handful of shifts that are actually active at that time. Players are still slotted in the original shift order so the columns come out the same as before."
    ]
   },
   {
    "cell_type": "code",
-   "execution_count": 26,
-   "id": "25443b99",
+   "execution_count": null,
+   "id": "dfa90313",
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_play_by_play(game_id):\n",
-    "    \n",
-    "    try:\n",
-    "        print('Scraping Game Id',game_id)\n",
-    "        pbp = get_pbp(game_id)\n",
-    "        goalies = get_goalies_id(game_id)\n",
-    "        \n",
-    "        cols_to_add = ['awayPlayer1','awayPlayer1_id','awayPlayer2','awayPlayer2_id','awayPlayer3','awayPlayer3_id','awayPlayer4',\n",
+    "awayPlayerList = ['awayPlayer1_id','awayPlayer2_id','awayPlayer3_id','awayPlayer4_id','awayPlayer5_id','awayPlayer6_id']\n",
+    "awayPlayerList_names = ['awayPlayer1','awayPlayer2','awayPlayer3','awayPlayer4','awayPlayer5','awayPlayer6']\n",
+    "homePlayerList = ['homePlayer1_id','homePlayer2_id','homePlayer3_id','homePlayer4_id','homePlayer5_id','homePlayer6_id']\n",
+    "homePlayerList_names = ['homePlayer1','homePlayer2','homePlayer3','homePlayer4','homePlayer5','homePlayer6']\n",
+    "\n",
+    "on_ice_cols = ['awayPlayer1','awayPlayer1_id','awayPlayer2','awayPlayer2_id','awayPlayer3','awayPlayer3_id','awayPlayer4',\n",
     "               'awayPlayer4_id','awayPlayer5','awayPlayer5_id','awayPlayer6','awayPlayer6_id','homePlayer1','homePlayer1_id',\n",
     "               'homePlayer2','homePlayer2_id','homePlayer3','homePlayer3_id','homePlayer4','homePlayer4_id','homePlayer5',\n",
     "               'homePlayer5_id','homePlayer6','homePlayer6_id','Away_Goalie','Away_Goalie_Id','Home_Goalie','Home_Goalie_Id']\n",
+    "\n",
+    "\n",
+    "def slot_on_ice_shifts(on_ice_shifts, shift_teams, shift_ids, away_team, home_team, goalies):\n",
+    "\n",
+    "    # Keep the original shift order so players land in the same slots, at most six per team\n",
+    "    away_slots = []\n",
+    "    home_slots = []\n",
+    "    away_goalie = None\n",
+    "    home_goalie = None\n",
+    "\n",
+    "    for i in sorted(on_ice_shifts):\n",
+    "\n",
+    "        if shift_teams[i] == away_team:\n",
+    "            slots = away_slots\n",
+    "        elif shift_teams[i] == home_team:\n",
+    "            slots = home_slots\n",
+    "        else:\n",
+    "            continue\n",
+    "\n",
+    "        if (shift_ids[i] not in [shift_ids[k] for k in slots]) & (len(slots) < len(awayPlayerList)):\n",
+    "            slots.append(i)\n",
+    "            if shift_ids[i] in goalies:\n",
+    "                if slots is away_slots:\n",
+    "                    away_goalie = i\n",
+    "                else:\n",
+    "                    home_goalie = i\n",
+    "\n",
+    "    return away_slots, home_slots, away_goalie, home_goalie\n",
+    "\n",
+    "\n",
+    "def add_on_ice_players(pbp, shifts, goalies):\n",
+    "\n",
+    "    on_ice = {col : [None]*len(pbp) for col in on_ice_cols}\n",
+    "\n",
+    "    # Shifts without an end time (still in progress) stay on the ice\n",
+    "    shift_periods = shifts['period'].tolist()\n",
+    "    shift_starts = shifts['start_seconds'].tolist()\n",
+    "    shift_ends = shifts['end_seconds'].fillna(float('inf')).tolist()\n",
+    "    shift_teams = shifts['team'].tolist()\n",
+    "    shift_ids = shifts['playerId'].tolist()\n",
+    "    shift_names = shifts['player'].tolist()\n",
+    "\n",
+    "    event_periods = pbp['Period'].tolist()\n",
+    "    event_times = pbp['Seconds_Elapsed'].tolist()\n",
+    "    event_tcs = pbp['Event_tc'].tolist()\n",
+    "    away_teams = pbp['Away_Team'].tolist()\n",
+    "    home_teams = pbp['Home_Team'].tolist()\n",
+    "\n",
+    "    period_shifts = {}\n",
+    "    for i in sorted(range(len(shifts)), key=lambda i: shift_starts[i]):\n",
+    "        period_shifts.setdefault(shift_periods[i], []).append(i)\n",
+    "\n",
+    "    period_events = {}\n",
+    "    for j in sorted(range(len(pbp)), key=lambda j: event_times[j]):\n",
+    "        period_events.setdefault(event_periods[j], []).append(j)\n",
+    "\n",
+    "    for period, events in period_events.items():\n",
+    "\n",
+    "        sorted_shifts = period_shifts.get(period, [])\n",
+    "        next_shift = 0\n",
+    "        active = []\n",
+    "\n",
+    "        for j in events:\n",
+    "\n",
+    "            current = event_times[j]\n",
+    "\n",
+    "            while (next_shift < len(sorted_shifts)) and (shift_starts[sorted_shifts[next_shift]] <= current):\n",
+    "                active.append(sorted_shifts[next_shift])\n",
+    "                next_shift += 1\n",
+    "\n",
+    "            active = [i for i in active if shift_ends[i] >= current]\n",
+    "\n",
+    "            on_ice_shifts = [i for i in active if check_if_on_ice_conditions_met(shift_starts[i],current,shift_ends[i],event_tcs[j]) == True]\n",
+    "\n",
+    "            away_slots, home_slots, away_goalie, home_goalie = slot_on_ice_shifts(on_ice_shifts, shift_teams, shift_ids, away_teams[j],\n",
+    "                                                                                  home_teams[j], goalies)\n",
+    "\n",
+    "            for slots, id_cols, name_cols in [(away_slots, awayPlayerList, awayPlayerList_names), (home_slots, homePlayerList, homePlayerList_names)]:\n",
+    "                for k, i in enumerate(slots):\n",
+    "                    on_ice[id_cols[k]][j] = shift_ids[i]\n",
+    "                    on_ice[name_cols[k]][j] = shift_names[i]\n",
+    "\n",
+    "            for i, goalie_cols in [(away_goalie, ('Away_Goalie_Id','Away_Goalie')), (home_goalie, ('Home_Goalie_Id','Home_Goalie'))]:\n",
+    "                if i is not None:\n",
+    "                    on_ice[goalie_cols[0]][j] = shift_ids[i]\n",
+    "                    on_ice[goalie_cols[1]][j] = shift_names[i]\n",
+    "\n",
+    "    for col in on_ice_cols:\n",
+    "        pbp[col] = pd.Series(on_ice[col], index=pbp.index, dtype=object)\n",
+    "\n",
+    "    return pbp"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "f8797e3b",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Shift Index\n",
+    "\n",
+    "`ShiftIndex` answers \"who was on the ice\" questions about one game's `get_shifts` frame without scanning it. For each period it keeps the sorted shift change points along with the set of shifts on the ice between each pair of them, so a point lookup is a binary search plus the shifts it returns (O(log n + k)).\n",
+    "\n",
+    "- `on_ice(period, second, event_tc=None)`: shifts on the ice at that second, using the same boundary rules as `check_if_on_ice_conditions_met` (pass `event_tc=502` for a faceoff; anything else, including `None`, is treated as a non-faceoff event).\n",
+    "- `overlapping(period, start, end)`: shifts that share some ice time with the window from `start` to `end`. A zero-length shift is on the ice at its one second, as in `on_ice`, so it counts whenever that second is inside the window, ends included.\n",
+    "- `shared_ice(player_id)`: IDs of every player who was on the ice at the same time as the player."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "d00c7877",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "class ShiftIndex:\n",
+    "    \n",
+    "    def __init__(self, shifts):\n",
     "        \n",
-    "        for col in cols_to_add:\n",
-    "            if col not in pbp.columns:\n",
-    "                pbp[col] = None\n",
+    "        self.shifts = shifts.reset_index(drop=True)\n",
+    "        self.periods = {}\n",
+    "        \n",
+    "        # Shifts without an end time (still in progress) stay on the ice\n",
+    "        shift_periods = self.shifts['period'].to_numpy()\n",
+    "        shift_starts = self.shifts['start_seconds'].to_numpy(dtype=float)\n",
+    "        shift_ends = self.shifts['end_seconds'].to_numpy(dtype=float, na_value=np.inf)\n",
+    "        \n",
+    "        for period in np.unique(shift_periods):\n",
+    "            \n",
+    "            in_period = np.flatnonzero((shift_periods == period) & (shift_starts <= shift_ends))\n",
+    "            zero_length = in_period[shift_starts[in_period] == shift_ends[in_period]]\n",
+    "            positive = in_period[shift_starts[in_period] < shift_ends[in_period]]\n",
+    "            \n",
+    "            starts_at = {}\n",
+    "            ends_at = {}\n",
+    "            zero_length_at = {}\n",
+    "            for i in positive:\n",
+    "                starts_at.setdefault(shift_starts[i], []).append(i)\n",
+    "                ends_at.setdefault(shift_ends[i], []).append(i)\n",
+    "            for i in zero_length:\n",
+    "                zero_length_at.setdefault(shift_starts[i], []).append(i)\n",
+    "            \n",
+    "            change_points = sorted(t for t in set(starts_at) | set(ends_at) | set(zero_length_at) if t != np.inf)\n",
+    "            \n",
+    "            # interval_shifts[k] holds the shifts on the ice between change point k and change point k+1\n",
+    "            active = set()\n",
+    "            interval_shifts = []\n",
+    "            for t in change_points:\n",
+    "                active.difference_update(ends_at.get(t, []))\n",
+    "                active.update(starts_at.get(t, []))\n",
+    "                interval_shifts.append(frozenset(active))\n",
     "                \n",
-    "        shifts = get_shifts(game_id)\n",
-    "        \n",
-    "        homePlayerList = ['homePlayer1_id','homePlayer2_id','homePlayer3_id','homePlayer4_id','homePlayer5_id','homePlayer6_id']\n",
-    "        homePlayerList_names = ['homePlayer1','homePlayer2','homePlayer3','homePlayer4','homePlayer5','homePlayer6']\n",
-    "        awayPlayerList = ['awayPlayer1_id','awayPlayer2_id','awayPlayer3_id','awayPlayer4_id','awayPlayer5_id','awayPlayer6_id']\n",
-    "        awayPlayerList_names = ['awayPlayer1','awayPlayer2','awayPlayer3','awayPlayer4','awayPlayer5','awayPlayer6']\n",
-    "\n",
-    "        for i in range(len(shifts)):\n",
-    "\n",
-    "            period = shifts.at[i,'period']\n",
-    "            shift_start = datetime.strptime(shifts.at[i,'start'],'%M:%S')\n",
-    "            shift_end = datetime.strptime(shifts.at[i,'end'],'%M:%S')\n",
-    "\n",
-    "            for j in range(len(pbp)):\n",
-    "\n",
-    "                time_elapsed = datetime.strptime(pbp.at[j,'Time_Elapsed'],'%M:%S')\n",
-    "\n",
-    "                awayPlayerList_loop = [pbp.at[j,'awayPlayer1_id'],pbp.at[j,'awayPlayer2_id'],pbp.at[j,'awayPlayer3_id'],\n",
-    "                                               pbp.at[j,'awayPlayer4_id'],pbp.at[j,'awayPlayer5_id'],pbp.at[j,'awayPlayer6_id']]\n",
-    "                homePlayerList_loop = [pbp.at[j,'homePlayer1_id'],pbp.at[j,'homePlayer2_id'],pbp.at[j,'homePlayer3_id'],\n",
-    "                                               pbp.at[j,'homePlayer4_id'],pbp.at[j,'homePlayer5_id'],pbp.at[j,'homePlayer6_id']]\n",
-    "\n",
-    "                if (period == pbp.at[j,'Period']) & (check_if_on_ice_conditions_met(shift_start,time_elapsed,shift_end,pbp.at[j,'Event_tc']) == True):\n",
-    "\n",
-    "                    if shifts.at[i,'team'] == pbp.at[j,'Away_Team']:\n",
-    "                        if shifts.at[i,'playerId'] not in awayPlayerList_loop:\n",
-    "                            for k in range(len(awayPlayerList)):\n",
-    "                                if pd.isna(pbp.at[j,awayPlayerList[k]]) == True:\n",
-    "                                    pbp.at[j,awayPlayerList[k]] = shifts.at[i,'playerId']\n",
-    "                                    pbp.at[j,awayPlayerList_names[k]] = shifts.at[i,'player']\n",
-    "                                    if shifts.at[i,'playerId'] in goalies:\n",
-    "                                        pbp.at[j,'Away_Goalie_Id'] = shifts.at[i,'playerId']\n",
-    "                                        pbp.at[j,'Away_Goalie'] = shifts.at[i,'player']\n",
-    "                                    break\n",
-    "\n",
-    "                    if shifts.at[i,'team'] == pbp.at[j,'Home_Team']:\n",
-    "                        if shifts.at[i,'playerId'] not in homePlayerList_loop:\n",
-    "                            for k in range(len(homePlayerList)):\n",
-    "                                if pd.isna(pbp.at[j,homePlayerList[k]]) == True:\n",
-    "                                    pbp.at[j,homePlayerList[k]] = shifts.at[i,'playerId']\n",
-    "                                    pbp.at[j,homePlayerList_names[k]] = shifts.at[i,'player']\n",
-    "                                    if shifts.at[i,'playerId'] in goalies:\n",
-    "                                        pbp.at[j,'Home_Goalie_Id'] = shifts.at[i,'playerId']\n",
-    "                                        pbp.at[j,'Home_Goalie'] = shifts.at[i,'player']\n",
-    "                                    break\n",
-    "                        \n",
-    "    except Exception as e:\n",
-    "        print('Unable to return play-by-play because of an issue at',e)\n",
-    "        return None\n",
+    "            start_order = positive[np.argsort(shift_starts[positive], kind='stable')]\n",
+    "            \n",
+    "            self.periods[period] = {'change_points' : change_points, 'interval_shifts' : interval_shifts,\n",
+    "                                    'zero_length_at' : zero_length_at, 'zero_length_times' : sorted(zero_length_at),\n",
+    "                                    'start_order' : start_order,\n",
+    "                                    'sorted_starts' : shift_starts[start_order]}\n",
+    "            \n",
+    "            \n",
+    "    def locate(self, period, second, event_tc=None):\n",
+    "        \n",
+    "        # Returns the stretch between change points that the event belongs to (-1 for none)\n",
+    "        # and any zero-length shifts at that exact second\n",
+    "        if period not in self.periods:\n",
+    "            return -1, []\n",
+    "        \n",
+    "        index = self.periods[period]\n",
+    "        k = bisect.bisect_right(index['change_points'], second) - 1\n",
+    "        \n",
+    "        if (k >= 0) and (index['change_points'][k] == second):\n",
+    "            # Faceoffs take the players coming on, everything else the players going off\n",
+    "            if event_tc != 502:\n",
+    "                k = k - 1\n",
+    "            return k, index['zero_length_at'].get(second, [])\n",
+    "        \n",
+    "        return k, []\n",
     "    \n",
-    "    else:\n",
+    "    \n",
+    "    def on_ice_shifts(self, period, second, event_tc=None):\n",
+    "        \n",
+    "        k, zero_length = self.locate(period, second, event_tc)\n",
+    "        on_ice = set(zero_length)\n",
+    "        if k >= 0:\n",
+    "            on_ice.update(self.periods[period]['interval_shifts'][k])\n",
+    "            \n",
+    "        return sorted(on_ice)\n",
+    "    \n",
+    "    \n",
+    "    def on_ice(self, period, second, event_tc=None):\n",
+    "        \n",
+    "        return self.shifts.iloc[self.on_ice_shifts(period, second, event_tc)]\n",
+    "    \n",
+    "    \n",
+    "    def overlapping_shifts(self, period, start, end):\n",
+    "        \n",
+    "        if period not in self.periods:\n",
+    "            return []\n",
+    "        \n",
+    "        index = self.periods[period]\n",
+    "        \n",
+    "        # Shifts already on the ice at the start of the window, plus those starting inside it\n",
+    "        k = bisect.bisect_right(index['change_points'], start) - 1\n",
+    "        overlapping = set(index['interval_shifts'][k]) if k >= 0 else set()\n",
+    "        first = np.searchsorted(index['sorted_starts'], start, side='right')\n",
+    "        last = np.searchsorted(index['sorted_starts'], end, side='left')\n",
+    "        overlapping.update(index['start_order'][first:last])\n",
+    "        \n",
+    "        # Zero-length shifts anywhere in the window, ends included, since on_ice counts them at their second\n",
+    "        times = index['zero_length_times']\n",
+    "        for t in times[bisect.bisect_left(times, start):bisect.bisect_right(times, end)]:\n",
+    "            overlapping.update(index['zero_length_at'][t])\n",
+    "        \n",
+    "        return sorted(overlapping)\n",
+    "    \n",
+    "    \n",
+    "    def overlapping(self, period, start, end):\n",
     "        \n",
-    "        return pbp"
+    "        return self.shifts.iloc[self.overlapping_shifts(period, start, end)]\n",
+    "    \n",
+    "    \n",
+    "    def shared_ice(self, player_id):\n",
+    "        \n",
+    "        player_ids = set()\n",
+    "        \n",
+    "        for shift in self.shifts[self.shifts['playerId'] == player_id].itertuples():\n",
+    "            end = np.inf if pd.isna(shift.end_seconds) else shift.end_seconds\n",
+    "            player_ids.update(self.shifts['playerId'].iloc[self.overlapping_shifts(shift.period, shift.start_seconds, end)])\n",
+    "            \n",
+    "        player_ids.discard(player_id)\n",
+    "        \n",
+    "        return player_ids"
    ]
   },
   {
    "cell_type": "code",
-   "execution_count": 27,
-   "id": "4a30bbde",
+   "execution_count": null,
+   "id": "acebfbd4",
    "metadata": {},
    "outputs": [],
    "source": [
-    "# %%time\n",
-    "\n",
     "# Testing\n",
-    "# get_play_by_play(2020020001)"
+    "# index = ShiftIndex(get_shifts(2023020001))\n",
+    "# index.on_ice(1, 600)\n",
+    "# index.overlapping(2, 300, 360)\n",
+    "# index.shared_ice(8478402)"
    ]
   },
   {
    "cell_type": "markdown",
-   "id": "58d32379",
+   "id": "5026960c",
    "metadata": {},
    "source": [
-    "### Getting Multiple Play-By-Plays"
+    "<br>\n",
+    "\n",
+    "### On-Ice Segments\n",
+    "\n",
+    "The 28 on-ice columns repeat the same units over and over. As an alternative, `get_on_ice_segments` cuts each period at every shift start and end: between two change points the players on the ice can't change, so each of those stretches becomes one row of a segment table (period, start/end seconds, home and away player IDs and goalies) and each event just gets the `Segment_Id` of the stretch it falls in. The boundary rules above decide which side of a change an event lands on: a faceoff at a change point belongs to the segment starting there, anything else to the segment ending there. Players with zero-length shifts at that exact second get their own instantaneous segment.\n",
+    "\n",
+    "`get_play_by_play(game_id, segments=True)` returns the play-by-play with a `Segment_Id` column plus the segment table, and `expand_segments` turns those back into the usual wide columns when they are needed."
    ]
   },
   {
    "cell_type": "code",
-   "execution_count": 28,
-   "id": "281578c6",
+   "execution_count": null,
+   "id": "baede7aa",
    "metadata": {},
    "outputs": [],
    "source": [
-    "def get_multi_play_by_play(range_of_ids):\n",
+    "segment_cols = ['Game_Id','Segment_Id','Period','start_seconds','end_seconds'] + awayPlayerList + homePlayerList + ['Away_Goalie_Id','Home_Goalie_Id']\n",
+    "\n",
+    "segment_schema = {'Game_Id' : 'int32', 'Segment_Id' : 'int32', 'Period' : 'int8', 'start_seconds' : 'Int16', 'end_seconds' : 'Int16'}\n",
+    "segment_schema.update({col : 'Int32' for col in awayPlayerList + homePlayerList + ['Away_Goalie_Id','Home_Goalie_Id']})\n",
+    "\n",
+    "\n",
+    "def get_on_ice_segments(pbp, shifts, goalies):\n",
+    "    \n",
+    "    event_segments = [-1]*len(pbp)\n",
+    "    segments = []\n",
+    "    \n",
+    "    if len(pbp) == 0:\n",
+    "        return event_segments, pd.DataFrame(segments, columns=segment_cols).astype(segment_schema)\n",
+    "    \n",
+    "    game_id = pbp['Game_Id'].iloc[0]\n",
+    "    away_team = pbp['Away_Team'].iloc[0]\n",
+    "    home_team = pbp['Home_Team'].iloc[0]\n",
+    "    \n",
+    "    index = ShiftIndex(shifts)\n",
+    "    shift_teams = index.shifts['team'].tolist()\n",
+    "    shift_ids = index.shifts['playerId'].tolist()\n",
+    "    \n",
+    "    event_periods = pbp['Period'].tolist()\n",
+    "    event_times = pbp['Seconds_Elapsed'].tolist()\n",
+    "    event_tcs = pbp['Event_tc'].tolist()\n",
+    "    \n",
+    "    def add_segment(period, start, end, on_ice_shifts, previous=-1):\n",
+    "        \n",
+    "        if len(on_ice_shifts) == 0:\n",
+    "            return -1\n",
+    "        \n",
+    "        away_slots, home_slots, away_goalie, home_goalie = slot_on_ice_shifts(on_ice_shifts, shift_teams, shift_ids, away_team,\n",
+    "                                                                              home_team, goalies)\n",
+    "        segment = {'Game_Id' : game_id, 'Segment_Id' : len(segments), 'Period' : period, 'start_seconds' : start,\n",
+    "                   'end_seconds' : None if end == float('inf') else end}\n",
+    "        for slots, id_cols in [(away_slots, awayPlayerList), (home_slots, homePlayerList)]:\n",
+    "            for k, i in enumerate(slots):\n",
+    "                segment[id_cols[k]] = shift_ids[i]\n",
+    "        segment['Away_Goalie_Id'] = None if away_goalie is None else shift_ids[away_goalie]\n",
+    "        segment['Home_Goalie_Id'] = None if home_goalie is None else shift_ids[home_goalie]\n",
+    "        segment['players'] = tuple(segment.get(col) for col in segment_cols[5:])\n",
+    "        \n",
+    "        # A change point where nobody actually changes (e.g. a player's shift split in two) just extends the segment before it\n",
+    "        if (previous >= 0) and (segments[previous]['players'] == segment['players']):\n",
+    "            segments[previous]['end_seconds'] = segment['end_seconds']\n",
+    "            return previous\n",
+    "        \n",
+    "        segments.append(segment)\n",
+    "        \n",
+    "        return segment['Segment_Id']\n",
     "    \n",
-    "    df = get_play_by_play(range_of_ids[0])\n",
+    "    period_events = {}\n",
+    "    for j in range(len(pbp)):\n",
+    "        period_events.setdefault(event_periods[j], []).append(j)\n",
     "    \n",
-    "    for i in range(1,len(range_of_ids)):\n",
-    "        df2 = get_play_by_play(range_of_ids[i])\n",
-    "        df = pd.concat([df,df2],axis=0)\n",
+    "    for period, period_index in index.periods.items():\n",
+    "        \n",
+    "        change_points = period_index['change_points']\n",
     "        \n",
-    "    return df"
+    "        # One segment per stretch between change points\n",
+    "        interval_segments = []\n",
+    "        for k, t in enumerate(change_points):\n",
+    "            end = change_points[k+1] if k+1 < len(change_points) else float('inf')\n",
+    "            previous = interval_segments[-1] if len(interval_segments) > 0 else -1\n",
+    "            interval_segments.append(add_segment(period, t, end, period_index['interval_shifts'][k], previous))\n",
+    "        \n",
+    "        instant_segments = {}\n",
+    "        for j in period_events.get(period, []):\n",
+    "            \n",
+    "            k, zero_length = index.locate(period, event_times[j], event_tcs[j])\n",
+    "            \n",
+    "            if len(zero_length) > 0:\n",
+    "                key = (event_times[j], event_tcs[j] == 502)\n",
+    "                if key not in instant_segments:\n",
+    "                    on_ice_shifts = index.on_ice_shifts(period, event_times[j], event_tcs[j])\n",
+    "                    instant_segments[key] = add_segment(period, event_times[j], event_times[j], on_ice_shifts)\n",
+    "                event_segments[j] = instant_segments[key]\n",
+    "            else:\n",
+    "                event_segments[j] = interval_segments[k] if k >= 0 else -1\n",
+    "    \n",
+    "    return event_segments, pd.DataFrame(segments, columns=segment_cols).astype(segment_schema)\n",
+    "\n",
+    "\n",
+    "def expand_segments(pbp, segments, roster=None):\n",
+    "    \n",
+    "    wide = pbp.merge(segments.drop(columns=['Period','start_seconds','end_seconds']), on=['Game_Id','Segment_Id'], how='left')\n",
+    "    \n",
+    "    for name_col, id_col in zip(awayPlayerList_names + homePlayerList_names + ['Away_Goalie','Home_Goalie'],\n",
+    "                                awayPlayerList + homePlayerList + ['Away_Goalie_Id','Home_Goalie_Id']):\n",
+    "        if roster is None:\n",
+    "            wide[name_col] = wide[id_col].map(lambda player_id: get_player_name({'playerId' : player_id}), na_action='ignore')\n",
+    "        else:\n",
+    "            wide[name_col] = wide[id_col].map(roster)\n",
+    "    \n",
+    "    return apply_pbp_schema(wide[list(pbp.columns) + on_ice_cols])"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "9a455fdf",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Output Schema\n",
+    "\n",
+    "Left to themselves, pandas stores most of the play-by-play as `object` columns, which made a season of data take several GB. `apply_pbp_schema` gives every column a compact dtype: categoricals for the repeated strings (events, teams, strengths, player names, ...), nullable `Int32` player IDs, small integers for periods, clocks, scores and skater counts and `float32` coordinates. `combine_games` merges the categories of each game before concatenating so a multi-game frame stays categorical."
    ]
   },
   {
    "cell_type": "code",
-   "execution_count": 29,
-   "id": "d3d1097d",
+   "execution_count": null,
+   "id": "78773579",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "player_name_cols = ['p1_name','p2_name','p3_name'] + awayPlayerList_names + homePlayerList_names + ['Away_Goalie','Home_Goalie']\n",
+    "player_id_cols = ['p1_ID','p2_ID','p3_ID'] + awayPlayerList + homePlayerList + ['Away_Goalie_Id','Home_Goalie_Id']\n",
+    "\n",
+    "pbp_schema = {'Game_Id' : 'int32', 'Period' : 'int8', 'Event_tc' : 'int16', 'Event' : 'category',\n",
+    "              'Time_Remaining' : 'category', 'Time_Elapsed' : 'category', 'Seconds_Elapsed' : 'int16',\n",
+    "              'Game_Seconds' : 'int16', 'Strength' : 'category', 'Type' : 'category', 'Ev_Team' : 'category',\n",
+    "              'Ev_Zone' : 'category', 'xC' : 'float32', 'yC' : 'float32', 'Home_Skaters' : 'Int8',\n",
+    "              'Away_Skaters' : 'Int8', 'Home_Score' : 'Int8', 'Away_Score' : 'Int8', 'Away_Team' : 'category',\n",
+    "              'Home_Team' : 'category', 'sortOrder' : 'int16', 'Segment_Id' : 'int32'}\n",
+    "pbp_schema.update({col : 'category' for col in player_name_cols})\n",
+    "pbp_schema.update({col : 'Int32' for col in player_id_cols})\n",
+    "\n",
+    "\n",
+    "def apply_pbp_schema(pbp):\n",
+    "    \n",
+    "    return pbp.astype({col : dtype for col, dtype in pbp_schema.items() if col in pbp.columns})"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "e40f802c",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Getting Combined Play-By-Play with Shift Data"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": 26,
+   "id": "25443b99",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def build_play_by_play(game_id, pbp_data=None, boxscore=None, shift_data=None, segments=False, incidence=False):\n",
+    "\n",
+    "    # The steps of get_play_by_play without its error handling, so callers like backfill_game see what went wrong\n",
+    "    if boxscore is None:\n",
+    "        boxscore = get_boxscore(game_id)\n",
+    "    pbp = get_pbp(game_id, boxscore, pbp_data)\n",
+    "    if pbp is None:\n",
+    "        raise ValueError('Unable to get play-by-play for Game_Id {}'.format(game_id))\n",
+    "    goalies = get_goalies_id(game_id, boxscore)\n",
+    "    shifts = get_shifts(game_id, shift_data)\n",
+    "    if shifts is None:\n",
+    "        raise ValueError('Unable to get shifts for Game_Id {}'.format(game_id))\n",
+    "    segment_table = None\n",
+    "\n",
+    "    if segments == True:\n",
+    "        event_segments, segment_table = get_on_ice_segments(pbp, shifts, goalies)\n",
+    "        pbp['Segment_Id'] = event_segments\n",
+    "    else:\n",
+    "        pbp = add_on_ice_players(pbp, shifts, goalies)\n",
+    "        \n",
+    "    pbp = apply_pbp_schema(pbp)\n",
+    "\n",
+    "    results = (pbp,)\n",
+    "    if segments == True:\n",
+    "        results += (segment_table,)\n",
+    "    if incidence == True:\n",
+    "        results += get_event_incidence(pbp, segment_table)\n",
+    "\n",
+    "    return results if len(results) > 1 else pbp\n",
+    "\n",
+    "\n",
+    "def get_play_by_play(game_id, pbp_data=None, boxscore=None, shift_data=None, segments=False, incidence=False):\n",
+    "\n",
+    "    # Final games already in the store are read back instead of being scraped and matched to shifts again\n",
+    "    if (store_dir is not None) and (pbp_data is None) and (segments == False):\n",
+    "        pbp = read_stored_game(game_id)\n",
+    "        if pbp is not None:\n",
+    "            return (pbp,) + get_event_incidence(pbp) if incidence == True else pbp\n",
+    "\n",
+    "    try:\n",
+    "        print('Scraping Game Id',game_id)\n",
+    "        return build_play_by_play(game_id, pbp_data, boxscore, shift_data, segments, incidence)\n",
+    "\n",
+    "    except Exception as e:\n",
+    "        print('Unable to return play-by-play because of an issue at',e)\n",
+    "        return None"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": 27,
+   "id": "4a30bbde",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# Testing\n",
+    "# get_play_by_play(2020020001)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "58d32379",
+   "metadata": {},
+   "source": [
+    "### Getting Multiple Play-By-Plays"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": 28,
+   "id": "281578c6",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def scrape_game(game_id):\n",
+    "    \n",
+    "    try:\n",
+    "        return get_play_by_play(game_id)\n",
+    "    \n",
+    "    except Exception as e:\n",
+    "        print('Unable to return play-by-play for Game_Id {} because of an issue at'.format(game_id),e)\n",
+    "        return None\n",
+    "\n",
+    "\n",
+    "def iter_play_by_play(range_of_ids, max_workers=1):\n",
+    "    \n",
+    "    failed = []\n",
+    "    ids = iter(range_of_ids)\n",
+    "    \n",
+    "    # Only max_workers games are in flight at a time, so memory stays bounded however long the list is\n",
+    "    with ThreadPoolExecutor(max_workers=max_workers) as executor:\n",
+    "        pending = deque((game_id, executor.submit(scrape_game, game_id)) for game_id in islice(ids, max_workers))\n",
+    "        \n",
+    "        while len(pending) > 0:\n",
+    "            game_id, future = pending.popleft()\n",
+    "            game = future.result()\n",
+    "            \n",
+    "            for next_id in islice(ids, 1):\n",
+    "                pending.append((next_id, executor.submit(scrape_game, next_id)))\n",
+    "                \n",
+    "            if game is None:\n",
+    "                failed.append(game_id)\n",
+    "            else:\n",
+    "                yield game\n",
+    "                \n",
+    "    if len(failed) > 0:\n",
+    "        print('Unable to scrape {} games:'.format(len(failed)),failed)\n",
+    "        \n",
+    "        \n",
+    "def combine_games(games):\n",
+    "    \n",
+    "    games = [game for game in games if game is not None]\n",
+    "    \n",
+    "    if len(games) == 0:\n",
+    "        return None\n",
+    "    \n",
+    "    # Categoricals only survive pd.concat if every game has the same categories. They are set on shallow copies\n",
+    "    # so the frames that were passed in keep their own categories.\n",
+    "    games = [game.copy(deep=False) for game in games]\n",
+    "    for col in games[0].columns:\n",
+    "        if isinstance(games[0][col].dtype, pd.CategoricalDtype):\n",
+    "            categories = pd.api.types.union_categoricals([game[col] for game in games if col in game.columns]).categories\n",
+    "            for game in games:\n",
+    "                if col in game.columns:\n",
+    "                    game[col] = game[col].cat.set_categories(categories)\n",
+    "    \n",
+    "    return pd.concat(games, axis=0, ignore_index=True)\n",
+    "\n",
+    "\n",
+    "def get_multi_play_by_play(range_of_ids, max_workers=1, as_generator=False, incidence=False):\n",
+    "    \n",
+    "    games = iter_play_by_play(range_of_ids, max_workers)\n",
+    "    \n",
+    "    if as_generator == True:\n",
+    "        if incidence == True:\n",
+    "            return ((game,) + get_event_incidence(game) for game in games)\n",
+    "        return games\n",
+    "    \n",
+    "    pbp = combine_games(games)\n",
+    "    \n",
+    "    if (incidence == True) and (pbp is not None):\n",
+    "        return (pbp,) + get_event_incidence(pbp)\n",
+    "    \n",
+    "    return pbp"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": 29,
+   "id": "d3d1097d",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# get_multi_play_by_play([2020020001,2020020003])\n",
+    "# get_multi_play_by_play([2020020001,2020020003],max_workers=8)\n",
+    "\n",
+    "# for game in get_multi_play_by_play([2020020001,2020020003],as_generator=True):\n",
+    "#     print(game.shape)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "4a042069",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Async Scraping\n",
+    "\n",
+    "`get_play_by_play` downloads the play-by-play, boxscore and shifts one after the other, so each game takes the sum of the three latencies. `async_get_play_by_play` requests all three at once and then builds the game from the downloaded data, and `async_get_multi_play_by_play` runs many games over one event loop, with at most `max_concurrency` games in flight. The requests still go through the shared session (on worker threads), so `set_session` works the same way here.\n",
+    "\n",
+    "In the notebook these can be awaited directly; in a script use `asyncio.run(async_get_multi_play_by_play(...))`."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "0531b730",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "fetch_executor = ThreadPoolExecutor(max_workers=2*pool_size) # requests for every host, kept apart from the parsing threads\n",
+    "\n",
+    "\n",
+    "async def async_get_json(url, cache_key=None):\n",
+    "    \n",
+    "    loop = asyncio.get_running_loop()\n",
+    "    \n",
+    "    return await loop.run_in_executor(fetch_executor, get_json, url, cache_key)\n",
+    "\n",
+    "\n",
+    "async def async_get_play_by_play(game_id, semaphore=None):\n",
+    "    \n",
+    "    if semaphore is None:\n",
+    "        semaphore = asyncio.Semaphore(1)\n",
+    "        \n",
+    "    async with semaphore:\n",
+    "        # Final games already in the store are read back, as in get_play_by_play\n",
+    "        if store_dir is not None:\n",
+    "            pbp = await asyncio.to_thread(read_stored_game, game_id)\n",
+    "            if pbp is not None:\n",
+    "                return pbp\n",
+    "            \n",
+    "        try:\n",
+    "            pbp_data, boxscore, shift_data = await asyncio.gather(\n",
+    "                async_get_json('{}/gamecenter/{}/play-by-play'.format(api_web_url, game_id), ('play-by-play', game_id)),\n",
+    "                async_get_json('{}/gamecenter/{}/boxscore'.format(api_web_url, game_id), ('boxscore', game_id)),\n",
+    "                async_get_json('{}/shiftcharts?cayenneExp=gameId={}'.format(api_stats_url, game_id), ('shiftcharts', game_id)))\n",
+    "            \n",
+    "        except Exception as e:\n",
+    "            print('Unable to download Game_Id {} because of an issue at'.format(game_id),e)\n",
+    "            return None\n",
+    "        \n",
+    "        else:\n",
+    "            return await asyncio.to_thread(get_play_by_play, game_id, pbp_data, boxscore, shift_data)\n",
+    "    \n",
+    "    \n",
+    "async def async_get_multi_play_by_play(range_of_ids, max_concurrency=8):\n",
+    "    \n",
+    "    semaphore = asyncio.Semaphore(max_concurrency)\n",
+    "    games = await asyncio.gather(*[async_get_play_by_play(game_id, semaphore) for game_id in range_of_ids])\n",
+    "    \n",
+    "    failed = [game_id for game_id, game in zip(range_of_ids, games) if game is None]\n",
+    "    if len(failed) > 0:\n",
+    "        print('Unable to scrape {} of {} games:'.format(len(failed),len(range_of_ids)),failed)\n",
+    "        \n",
+    "    return combine_games(games)"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "43c81314",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# await async_get_play_by_play(2020020001)\n",
+    "# await async_get_multi_play_by_play([2020020001,2020020003],max_concurrency=8)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "4f759518",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Time on Ice\n",
+    "\n",
+    "`get_toi(shifts, pbp=None)` adds up each player's time on ice from shift frames, with one column per period. It takes the frame from `get_shifts`, or a list of frames or one concatenated frame for many games. Shifts without an end time are left out.\n",
+    "\n",
+    "If the play-by-play of the same games is passed as well, the TOI is also split by strength, relative to the player's team: `TOI_5v5`, `TOI_PP`, `TOI_SH`, `TOI_EV` (any other even strength, e.g. 4v4 or 3v3) and `TOI_EN` (either net empty). The strength comes from the `situationCode` of each event (the `Strength` column). Reading it as away goalie, away skaters, home skaters, home goalie, the situation is taken to hold from an event until the next event.\n",
+    "\n",
+    "This is done without looping over shifts. All the games are laid out end to end on one time axis. For each strength state there is a running total of the seconds spent in it, and `np.interp` reads that total off at every shift start and end. The difference between the two is the shift's time in that state, so even a season of shifts only takes a few array operations. With `by_game=False` the totals are summed over all games instead of kept per game."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "c802b47e",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "strength_states = ['5v5','PP','SH','EV','EN']\n",
+    "game_offset = 100000 # spacing between games on the shared time axis, longer than any game\n",
+    "\n",
+    "\n",
+    "def get_strength_states(pbp):\n",
+    "\n",
+    "    # situationCode: away goalie, away skaters, home skaters, home goalie. PP and SH are from the home team's side here\n",
+    "    # Only the few distinct codes are decoded, then spread back over the events\n",
+    "    codes, situations = pd.factorize(pbp['Strength'])\n",
+    "    code = pd.Series(situations, dtype=object).astype(str)\n",
+    "    away_goalie = pd.to_numeric(code.str[0], errors='coerce')\n",
+    "    away_skaters = pd.to_numeric(code.str[1], errors='coerce')\n",
+    "    home_skaters = pd.to_numeric(code.str[2], errors='coerce')\n",
+    "    home_goalie = pd.to_numeric(code.str[3], errors='coerce')\n",
+    "\n",
+    "    states = np.select([(away_goalie == 0) | (home_goalie == 0), home_skaters > away_skaters, home_skaters < away_skaters,\n",
+    "                        (home_skaters == 5) & (away_skaters == 5), home_skaters == away_skaters],\n",
+    "                       ['EN','PP','SH','5v5','EV'], default='')\n",
+    "\n",
+    "    # Missing codes (-1) pick up the '' on the end\n",
+    "    return np.append(states, '')[codes]\n",
+    "\n",
+    "\n",
+    "def get_strength_toi(shifts, pbp):\n",
+    "\n",
+    "    events = pd.DataFrame({'Game_Id' : pbp['Game_Id'].to_numpy(), 'Game_Seconds' : pbp['Game_Seconds'].to_numpy(),\n",
+    "                           'sortOrder' : pbp['sortOrder'].to_numpy(), 'state' : get_strength_states(pbp)})\n",
+    "\n",
+    "    # When several events share a second, the last one sets the state from there on\n",
+    "    events = events.sort_values(['Game_Id','Game_Seconds','sortOrder']).drop_duplicates(['Game_Id','Game_Seconds'], keep='last')\n",
+    "\n",
+    "    games = pd.Index(events['Game_Id'].unique())\n",
+    "    x = games.get_indexer(events['Game_Id'])*game_offset + events['Game_Seconds'].to_numpy(dtype=float)\n",
+    "    states = events['state'].to_numpy()\n",
+    "\n",
+    "    shift_games = games.get_indexer(shifts['Game_Id'])\n",
+    "    shift_starts = shift_games*game_offset + shifts['game_start_seconds'].to_numpy(dtype=float)\n",
+    "    shift_ends = shift_games*game_offset + shifts['game_end_seconds'].to_numpy(dtype=float)\n",
+    "\n",
+    "    home_teams = pbp.drop_duplicates('Game_Id').set_index('Game_Id')['Home_Team'].astype(str)\n",
+    "    is_home = (shifts['team'] == shifts['Game_Id'].map(home_teams)).to_numpy()\n",
+    "\n",
+    "    strength_toi = {}\n",
+    "    for state in strength_states:\n",
+    "        # Seconds spent in the state up to each change point, read off at every shift start and end\n",
+    "        elapsed = np.concatenate([[0], np.cumsum(np.where(states[:-1] == state, np.diff(x), 0))])\n",
+    "        strength_toi[state] = np.interp(shift_ends, x, elapsed) - np.interp(shift_starts, x, elapsed)\n",
+    "\n",
+    "    # Shifts from games missing in the play-by-play get no strength split\n",
+    "    for state in strength_states:\n",
+    "        strength_toi[state] = np.where(shift_games >= 0, strength_toi[state], 0)\n",
+    "\n",
+    "    strength_toi['PP'], strength_toi['SH'] = (np.where(is_home, strength_toi['PP'], strength_toi['SH']),\n",
+    "                                              np.where(is_home, strength_toi['SH'], strength_toi['PP']))\n",
+    "\n",
+    "    return strength_toi\n",
+    "\n",
+    "\n",
+    "def get_toi(shifts, pbp=None, by_game=True):\n",
+    "\n",
+    "    if isinstance(shifts, list):\n",
+    "        shifts = pd.concat(shifts, ignore_index=True)\n",
+    "    if isinstance(pbp, list):\n",
+    "        pbp = combine_games(pbp)\n",
+    "\n",
+    "    # Shifts still in progress don't have a length yet\n",
+    "    shifts = shifts[shifts['game_end_seconds'].notna()]\n",
+    "\n",
+    "    toi = shifts[['Game_Id','playerId','player','team']].copy()\n",
+    "    toi['TOI'] = np.clip(shifts['game_end_seconds'].to_numpy(dtype=float) - shifts['game_start_seconds'].to_numpy(dtype=float), 0, None)\n",
+    "    toi_cols = ['TOI']\n",
+    "\n",
+    "    if (pbp is not None) and (len(pbp) > 0):\n",
+    "        for state, seconds in get_strength_toi(shifts, pbp).items():\n",
+    "            toi['TOI_' + state] = seconds\n",
+    "            toi_cols.append('TOI_' + state)\n",
+    "\n",
+    "    for period in sorted(shifts['period'].unique()):\n",
+    "        toi['TOI_P{}'.format(period)] = np.where(shifts['period'] == period, toi['TOI'], 0)\n",
+    "        toi_cols.append('TOI_P{}'.format(period))\n",
+    "\n",
+    "    agg = {'player' : 'first', 'team' : 'last'}\n",
+    "    if by_game == True:\n",
+    "        keys = ['Game_Id','playerId']\n",
+    "    else:\n",
+    "        keys = ['playerId']\n",
+    "        agg['Game_Id'] = 'nunique'\n",
+    "    agg.update({col : 'sum' for col in toi_cols})\n",
+    "\n",
+    "    toi = toi.groupby(keys).agg(agg).reset_index().rename(columns={'Game_Id' : 'GP'} if by_game == False else {})\n",
+    "\n",
+    "    return toi.astype({col : 'int32' for col in toi_cols})"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "28c6970b",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# shifts = get_shifts(2023020001)\n",
+    "# get_toi(shifts, get_play_by_play(2023020001))"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "68eeeb41",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Shared Ice Time\n",
+    "\n",
+    "`get_shared_ice(shifts, player_index=None)` returns how many seconds every pair of players spent on the ice together. It gives two sparse player x player matrices, `teammates` and `opponents`, plus the `player_index` (sorted player IDs) that numbers their rows and columns. The diagonal of `teammates` is each player's time on ice. Pass one game's shifts for a single game, or a list or concatenation of shift frames to add up a season. Passing the same `player_index` each time keeps separate results lined up.\n",
+    "\n",
+    "Comparing every shift with every other shift grows with the square of the number of shifts. Instead, all the games are put on one time axis (as in `get_toi`) and cut at every shift start and end into stretches in which the players on the ice can't change. A binary search over the sorted cut points finds the stretches each shift covers. That gives a stretch x player matrix `A`, with a diagonal matrix `D` of stretch lengths, and `A.T @ D @ A` is the time every pair shared. Doing the same with `+1`/`-1` for the two teams gives teammates minus opponents, so each of them is half the sum or half the difference of the two products.\n",
+    "\n",
+    "`get_shared_ice_pairs(matrix, player_index)` lists the non-zero pairs of either matrix as a DataFrame."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "658fde5e",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def get_player_index(player_ids):\n",
+    "\n",
+    "    return pd.Index(np.unique(np.asarray(player_ids, dtype=np.int64)), name='playerId')\n",
+    "\n",
+    "\n",
+    "def get_shared_ice(shifts, player_index=None):\n",
+    "\n",
+    "    if isinstance(shifts, list):\n",
+    "        shifts = pd.concat(shifts, ignore_index=True)\n",
+    "    if player_index is None:\n",
+    "        player_index = get_player_index(shifts['playerId'])\n",
+    "\n",
+    "    # Shifts still in progress and zero-length shifts don't share any time\n",
+    "    shifts = shifts[shifts['game_end_seconds'] > shifts['game_start_seconds']]\n",
+    "    players = player_index.get_indexer(shifts['playerId'])\n",
+    "    shifts = shifts[players >= 0]\n",
+    "    players = players[players >= 0]\n",
+    "\n",
+    "    # All the games on one time axis, with +1 for one team of each game and -1 for the other\n",
+    "    games = pd.factorize(shifts['Game_Id'])[0]\n",
+    "    starts = games*game_offset + shifts['game_start_seconds'].to_numpy(dtype=float)\n",
+    "    ends = games*game_offset + shifts['game_end_seconds'].to_numpy(dtype=float)\n",
+    "    sides = np.where(shifts['team'] == shifts.groupby('Game_Id')['team'].transform('first'), 1, -1)\n",
+    "\n",
+    "    # Every shift start and end cuts the axis into stretches in which nobody comes on or goes off\n",
+    "    boundaries = np.unique(np.concatenate([starts, ends]))\n",
+    "    seconds = np.diff(boundaries)\n",
+    "    first = np.searchsorted(boundaries, starts)\n",
+    "    count = np.searchsorted(boundaries, ends) - first\n",
+    "\n",
+    "    # One entry for each stretch a shift covers, and a player only once per stretch even if two of their shifts overlap\n",
+    "    shift_rows = np.repeat(np.arange(len(first)), count)\n",
+    "    stretches = np.arange(count.sum()) + np.repeat(first - (np.cumsum(count) - count), count)\n",
+    "    entries = np.unique(stretches.astype(np.int64)*len(player_index) + players[shift_rows], return_index=True)[1]\n",
+    "    stretches = stretches[entries]\n",
+    "    players = players[shift_rows[entries]]\n",
+    "    sides = sides[shift_rows[entries]]\n",
+    "\n",
+    "    shape = (len(seconds), len(player_index))\n",
+    "    on_ice = sparse.csr_matrix((np.ones(len(stretches)), (stretches, players)), shape=shape)\n",
+    "    signed = sparse.csr_matrix((sides.astype(float), (stretches, players)), shape=shape)\n",
+    "    lengths = sparse.diags(seconds)\n",
+    "\n",
+    "    together = on_ice.T @ lengths @ on_ice\n",
+    "    difference = signed.T @ lengths @ signed\n",
+    "\n",
+    "    teammates = ((together + difference)/2).astype(np.int32).tocsr()\n",
+    "    opponents = ((together - difference)/2).astype(np.int32).tocsr()\n",
+    "    teammates.eliminate_zeros()\n",
+    "    opponents.eliminate_zeros()\n",
+    "\n",
+    "    return teammates, opponents, player_index\n",
+    "\n",
+    "\n",
+    "def get_shared_ice_pairs(matrix, player_index):\n",
+    "\n",
+    "    # Each pair once (the matrices are symmetric), without the diagonal\n",
+    "    pairs = sparse.triu(matrix, k=1).tocoo()\n",
+    "\n",
+    "    return pd.DataFrame({'playerId_1' : player_index[pairs.row], 'playerId_2' : player_index[pairs.col],\n",
+    "                         'seconds' : pairs.data}).sort_values('seconds', ascending=False, ignore_index=True)"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "2af079f7",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# teammates, opponents, player_index = get_shared_ice(get_shifts(2023020001))\n",
+    "# get_shared_ice_pairs(teammates, player_index)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "f0281e70",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Event x Player Incidence\n",
+    "\n",
+    "Adding up on-ice stats from the 12 `homePlayerN_id`/`awayPlayerN_id` columns means melting them into one row per event and player first. `get_event_incidence(pbp, segments=None, player_index=None)` instead returns a SciPy sparse matrix with one row per event (in the frame's order) and one column per player in `player_index`. An entry is `+1` if the player was on the ice for the home team at that event and `-1` if they were on the ice for the away team. It is built from the wide on-ice columns, or from the `Segment_Id` column and the segment table when `segments` is given.\n",
+    "\n",
+    "On-ice totals then become matrix-vector products. For example, with `goal` as `+1` for a home goal, `-1` for an away goal and `0` for other events, `incidence.T @ goal` is every player's on-ice goal differential. `abs(incidence).T @ is_goal` is the number of goals they were on the ice for.\n",
+    "\n",
+    "`get_play_by_play(game_id, incidence=True)` and `get_multi_play_by_play(range_of_ids, incidence=True)` also return the matrix and its `player_index` (for the multi-game frame it covers all the games). `save_event_incidence(path, incidence, player_index)` writes the matrix to `path.npz` and the player index to `path_players.json` next to it. `load_event_incidence(path)` reads both back."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "157fd1a3",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def get_on_ice_ids(pbp, segments=None):\n",
+    "\n",
+    "    if segments is not None:\n",
+    "        pbp = pbp[['Game_Id','Segment_Id']].merge(segments[['Game_Id','Segment_Id'] + homePlayerList + awayPlayerList],\n",
+    "                                                  on=['Game_Id','Segment_Id'], how='left')\n",
+    "\n",
+    "    # One row per event with the home players then the away players, and +1 for home and -1 for away\n",
+    "    player_ids = np.concatenate([pbp[homePlayerList].to_numpy(dtype=float, na_value=np.nan),\n",
+    "                                 pbp[awayPlayerList].to_numpy(dtype=float, na_value=np.nan)], axis=1)\n",
+    "    sides = np.repeat(np.array([1,-1], dtype=np.int8), len(homePlayerList))\n",
+    "\n",
+    "    return player_ids, sides\n",
+    "\n",
+    "\n",
+    "def get_event_incidence(pbp, segments=None, player_index=None):\n",
+    "\n",
+    "    player_ids, sides = get_on_ice_ids(pbp, segments)\n",
+    "    signs = np.tile(sides, (len(player_ids), 1))\n",
+    "    rows = np.repeat(np.arange(len(player_ids)), player_ids.shape[1]).reshape(player_ids.shape)\n",
+    "\n",
+    "    on_ice = ~np.isnan(player_ids)\n",
+    "    player_ids = player_ids[on_ice].astype(np.int64)\n",
+    "    if player_index is None:\n",
+    "        player_index = get_player_index(player_ids)\n",
+    "\n",
+    "    cols = player_index.get_indexer(player_ids)\n",
+    "    in_index = cols >= 0\n",
+    "\n",
+    "    incidence = sparse.csr_matrix((signs[on_ice][in_index], (rows[on_ice][in_index], cols[in_index])),\n",
+    "                                  shape=(len(rows), len(player_index)), dtype=np.int8)\n",
+    "\n",
+    "    return incidence, player_index\n",
+    "\n",
+    "\n",
+    "def save_event_incidence(path, incidence, player_index):\n",
+    "\n",
+    "    sparse.save_npz(path + '.npz', incidence)\n",
+    "    with open(path + '_players.json', 'w') as f:\n",
+    "        json.dump([int(player_id) for player_id in player_index], f)\n",
+    "\n",
+    "\n",
+    "def load_event_incidence(path):\n",
+    "\n",
+    "    incidence = sparse.load_npz(path + '.npz')\n",
+    "    with open(path + '_players.json') as f:\n",
+    "        player_index = get_player_index(json.load(f))\n",
+    "\n",
+    "    return incidence, player_index"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "001c5e86",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# pbp, incidence, player_index = get_play_by_play(2023020001, incidence=True)\n",
+    "# goal = np.where(pbp['Event_tc'] == 505, np.where(pbp['Ev_Team'].astype(str) == pbp['Home_Team'].astype(str), 1, -1), 0)\n",
+    "# pd.Series(incidence.T @ goal, index=player_index)\n",
+    "\n",
+    "# save_event_incidence('2023020001_incidence', incidence, player_index)\n",
+    "# load_event_incidence('2023020001_incidence')"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "ead1c15e",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### On-Ice Shot Attempts\n",
+    "\n",
+    "`get_on_ice_shots(pbp, segments=None, by_strength=True)` counts, for every player in every game, the shots taken while they were on the ice. It returns one row per game, player and strength state:\n",
+    "\n",
+    "- `CF`/`CA`: shot attempts for and against (`shotCodes`: goals, shots on goal, missed and blocked shots)\n",
+    "- `FF`/`FA`: unblocked shot attempts (no blocked shots)\n",
+    "- `SF`/`SA`: shots on goal (goals included)\n",
+    "- `GF`/`GA`: goals\n",
+    "\n",
+    "The strength state (`5v5`, `PP`, `SH`, `EV`, `EN`) is the one from the Time on Ice section, relative to the player's team. With `by_strength=False` the states are added together.\n",
+    "\n",
+    "Only the shot events are kept. Their on-ice players are laid out as one long array of (event, player) pairs with the same `get_on_ice_ids` used for the incidence matrix, so the whole thing is a few NumPy comparisons and one groupby, even over a season-sized frame from `get_multi_play_by_play`. The NHL API gives blocked shots to the blocking team (`Ev_Team`), so for those the attempt is credited to the other team."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "b8262173",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "onIceShots = {'C' : shotCodes, 'F' : [505,506,507], 'S' : [505,506], 'G' : [505]}\n",
+    "\n",
+    "\n",
+    "def get_on_ice_shots(pbp, segments=None, by_strength=True):\n",
+    "\n",
+    "    shots = pbp[pbp['Event_tc'].isin(shotCodes) & pbp['Ev_Team'].notna()]\n",
+    "\n",
+    "    player_ids, sides = get_on_ice_ids(shots, segments)\n",
+    "    event_tcs = shots['Event_tc'].to_numpy()\n",
+    "    home_teams = shots['Home_Team'].astype(str).to_numpy()\n",
+    "    away_teams = shots['Away_Team'].astype(str).to_numpy()\n",
+    "\n",
+    "    # +1 if the home team took the shot and -1 if the away team did (blocked shots belong to the blocking team)\n",
+    "    shot_sides = np.where(shots['Ev_Team'].astype(str).to_numpy() == home_teams, 1, -1)*np.where(event_tcs == 508, -1, 1)\n",
+    "    states = get_strength_states(shots)\n",
+    "\n",
+    "    # One entry per player on the ice for each shot\n",
+    "    rows, slots = np.nonzero(~np.isnan(player_ids))\n",
+    "    player_sides = sides[slots]\n",
+    "    is_for = player_sides == shot_sides[rows]\n",
+    "    player_states = states[rows]\n",
+    "    player_states = np.where(player_sides == 1, player_states,\n",
+    "                             np.select([player_states == 'PP', player_states == 'SH'], ['SH','PP'], player_states))\n",
+    "\n",
+    "    on_ice = pd.DataFrame({'Game_Id' : shots['Game_Id'].to_numpy()[rows], 'playerId' : player_ids[rows, slots].astype(np.int64),\n",
+    "                           'team' : np.where(player_sides == 1, home_teams[rows], away_teams[rows])})\n",
+    "    if by_strength == True:\n",
+    "        on_ice['Strength_State'] = player_states\n",
+    "\n",
+    "    keys = list(on_ice.columns)\n",
+    "    for stat, codes in onIceShots.items():\n",
+    "        is_stat = np.isin(event_tcs[rows], codes)\n",
+    "        on_ice[stat + 'F'] = (is_stat & is_for).astype(np.int32)\n",
+    "        on_ice[stat + 'A'] = (is_stat & ~is_for).astype(np.int32)\n",
+    "\n",
+    "    return on_ice.groupby(keys).sum().reset_index()"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "70aeae1e",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# pbp = get_multi_play_by_play([2023020001,2023020002])\n",
+    "# get_on_ice_shots(pbp)\n",
+    "# get_on_ice_shots(pbp, by_strength=False)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "892ace1a",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Live Games\n",
+    "\n",
+    "Polling an in-progress game with `get_play_by_play` parses every event and matches every event to the shifts again on each poll. `LiveGame(game_id)` keeps that work between polls. It fetches the boxscore and goalies once, in the first `update()` whose boxscore lists the goalies (so an update before puck drop prints the issue, returns `None` and leaves the rest for the next one). Each call to `update()` then downloads the play-by-play and the shift chart, which the API only serves whole. From those it:\n",
+    "\n",
+    "- parses only the plays with a `sortOrder` after the last one it has seen;\n",
+    "- compares the shifts with the ones it already has by shift `id`, to find new, changed (usually an end time being filled in) and removed shifts;\n",
+    "- matches on-ice players only for the new events, plus the earlier events that fall within a changed shift. Only the shifts overlapping those events are used.\n",
+    "\n",
+    "`update()` returns just the new and re-matched events. `get_play_by_play()` returns every event so far, in the same format as `get_play_by_play(game_id)`. `is_final()` tells a polling loop when it can stop. Plays the API edits after they have been seen are not parsed again."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "826ceb57",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "shift_cols = ['player','playerId','team','period','start','start_seconds','game_start_seconds','end','end_seconds','game_end_seconds']\n",
+    "\n",
+    "\n",
+    "class LiveGame:\n",
+    "\n",
+    "    def __init__(self, game_id):\n",
+    "\n",
+    "        self.game_id = game_id\n",
+    "        self.boxscore = None # fetched by update() once the boxscore lists the goalies\n",
+    "        self.goalies = None\n",
+    "        self.game_state = None\n",
+    "        self.last_sort_order = -1\n",
+    "        self.raw_shifts = {} # shift id -> shift as it came from the API\n",
+    "        self.shifts = {} # shift id -> parse_shifts of it\n",
+    "        self.shift_order = {} # shift id -> position in the last shift chart\n",
+    "        self.pbp = None\n",
+    "\n",
+    "\n",
+    "    def is_final(self):\n",
+    "\n",
+    "        return self.game_state in ['OFF','FINAL']\n",
+    "\n",
+    "\n",
+    "    def update_shifts(self, shift_data):\n",
+    "\n",
+    "        # Returns the old and new versions of every shift that was added, changed or removed\n",
+    "        changed = []\n",
+    "        shift_list = shift_data.get('data')\n",
+    "        self.shift_order = {shift['id'] : i for i, shift in enumerate(shift_list)}\n",
+    "\n",
+    "        for shift in shift_list:\n",
+    "            if self.raw_shifts.get(shift['id']) != shift:\n",
+    "                if shift['id'] in self.shifts:\n",
+    "                    changed.append(self.shifts[shift['id']])\n",
+    "                self.raw_shifts[shift['id']] = shift\n",
+    "                self.shifts[shift['id']] = parse_shifts(shift)\n",
+    "                changed.append(self.shifts[shift['id']])\n",
+    "\n",
+    "        for shift_id in [shift_id for shift_id in self.shifts if shift_id not in self.shift_order]:\n",
+    "            changed.append(self.shifts.pop(shift_id))\n",
+    "            del self.raw_shifts[shift_id]\n",
+    "\n",
+    "        return changed\n",
+    "\n",
+    "\n",
+    "    def get_shift_frame(self, events):\n",
+    "\n",
+    "        # Only the shifts overlapping the events, in the order of the shift chart so players keep their usual slots\n",
+    "        times = events.groupby('Period')['Seconds_Elapsed'].agg(['min','max'])\n",
+    "        times = dict(zip(times.index, zip(times['min'], times['max'])))\n",
+    "        overlapping = []\n",
+    "        for shift_id, shift in self.shifts.items():\n",
+    "            if shift['period'] in times:\n",
+    "                first, last = times[shift['period']]\n",
+    "                if (shift['start_seconds'] <= last) & ((shift['end_seconds'] is None) or (shift['end_seconds'] >= first)):\n",
+    "                    overlapping.append(shift_id)\n",
+    "\n",
+    "        overlapping.sort(key=lambda shift_id: self.shift_order[shift_id])\n",
+    "\n",
+    "        shifts = pd.DataFrame([self.shifts[shift_id] for shift_id in overlapping], columns=shift_cols)\n",
+    "\n",
+    "        # Keeps the end times numeric even when every shift in the frame is still in progress\n",
+    "        return shifts.astype({'end_seconds' : float, 'game_end_seconds' : float})\n",
+    "\n",
+    "\n",
+    "    def update(self, pbp_data=None, shift_data=None):\n",
+    "\n",
+    "        try:\n",
+    "            if pbp_data is None:\n",
+    "                pbp_data = get_json('{}/gamecenter/{}/play-by-play'.format(api_web_url, self.game_id))\n",
+    "            if shift_data is None:\n",
+    "                shift_data = get_json('{}/shiftcharts?cayenneExp=gameId={}'.format(api_stats_url, self.game_id))\n",
+    "\n",
+    "            # The rosterSpots seed the player cache first, so the goalies' names don't need their landing pages.\n",
+    "            # Before puck drop the boxscore may not list them yet, and then the next update tries again.\n",
+    "            update_player_cache(pbp_data.get('rosterSpots', []))\n",
+    "            if not self.goalies:\n",
+    "                boxscore = get_boxscore(self.game_id)\n",
+    "                goalies = get_goalies_id(self.game_id, boxscore) if boxscore is not None else None\n",
+    "                if not goalies:\n",
+    "                    raise ValueError('the boxscore does not list the goalies yet')\n",
+    "                self.boxscore, self.goalies = boxscore, goalies\n",
+    "\n",
+    "            self.game_state = pbp_data.get('gameState')\n",
+    "            new_plays = [play for play in pbp_data['plays'] if play['sortOrder'] > self.last_sort_order]\n",
+    "            changed_shifts = self.update_shifts(shift_data)\n",
+    "\n",
+    "            events = []\n",
+    "\n",
+    "            # Events already matched that a changed shift was (or is now) on the ice for\n",
+    "            updated = []\n",
+    "            if (self.pbp is not None) and (len(changed_shifts) > 0):\n",
+    "                periods = self.pbp['Period'].to_numpy()\n",
+    "                times = self.pbp['Seconds_Elapsed'].to_numpy()\n",
+    "                touched = np.zeros(len(self.pbp), dtype=bool)\n",
+    "                for shift in changed_shifts:\n",
+    "                    end = float('inf') if shift['end_seconds'] is None else shift['end_seconds']\n",
+    "                    touched |= (periods == shift['period']) & (times >= shift['start_seconds']) & (times <= end)\n",
+    "                updated = self.pbp.index[touched]\n",
+    "                events.append(self.pbp.loc[updated].drop(columns=on_ice_cols))\n",
+    "\n",
+    "            if len(new_plays) > 0:\n",
+    "                new_events = get_pbp(self.game_id, self.boxscore, dict(pbp_data, plays=new_plays))\n",
+    "                first = 0 if self.pbp is None else len(self.pbp)\n",
+    "                new_events.index = range(first, first + len(new_events))\n",
+    "\n",
+    "                # get_pbp starts the score at 0, here the new events carry on from the last known score until their first goal\n",
+    "                if self.pbp is not None:\n",
+    "                    before_goal = (new_events['Event_tc'] == 505).cumsum() == 0\n",
+    "                    for col in ['Home_Score','Away_Score']:\n",
+    "                        new_events.loc[before_goal, col] = self.pbp[col].iloc[-1]\n",
+    "\n",
+    "                events.append(new_events)\n",
+    "\n",
+    "            if len(events) == 0:\n",
+    "                return apply_pbp_schema(self.pbp.iloc[0:0]) if self.pbp is not None else None\n",
+    "\n",
+    "            events = pd.concat(events)\n",
+    "            events = add_on_ice_players(events, self.get_shift_frame(events), self.goalies)\n",
+    "\n",
+    "        except Exception as e:\n",
+    "            print('Unable to update Game_Id {} because of an issue at'.format(self.game_id),e)\n",
+    "            return None\n",
+    "\n",
+    "        else:\n",
+    "            if self.pbp is None:\n",
+    "                self.pbp = events\n",
+    "            else:\n",
+    "                # The re-matched events replace their old rows and the new events go on the end\n",
+    "                self.pbp = pd.concat([self.pbp.drop(index=updated), events]).sort_index()\n",
+    "\n",
+    "            self.last_sort_order = self.pbp['sortOrder'].max()\n",
+    "\n",
+    "            return apply_pbp_schema(events.sort_index())\n",
+    "\n",
+    "\n",
+    "    def get_play_by_play(self):\n",
+    "\n",
+    "        if self.pbp is None:\n",
+    "            return None\n",
+    "\n",
+    "        return apply_pbp_schema(self.pbp)"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "17fd2fa3",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# # Testing\n",
+    "# game = LiveGame(2023020001)\n",
+    "# while game.is_final() == False:\n",
+    "#     new_events = game.update()\n",
+    "#     time.sleep(30)\n",
+    "# game.get_play_by_play()"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "9954d814",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Parquet Store\n",
+    "\n",
+    "With `set_store('nhl_store')`, `store_game(game_id)` scrapes a game and writes its play-by-play and shifts to `nhl_store/{table}/season={season}/game_type={game_type}/{game_id}.parquet`, one file per game per table (`pbp` and `shifts`). The season (e.g. `20232024`) and game type (`1` preseason, `2` regular season, `3` playoffs) come from the `game_id` itself: `2023020001` is game 1 of the 2023-24 regular season. Writing a game again replaces its files. `write_game(game_id, pbp, shifts, game_state)` writes frames that have already been scraped. A small `games` table keeps the game state (`gameState` of the play-by-play) each game had when it was stored, and `get_stored_games(season=None)` returns it as a dictionary.\n",
+    "\n",
+    "`read_store(table='pbp', columns=None, season=None, game_type=None, team=None, event=None, filters=None)` reads the store back with pyarrow, only loading the listed `columns`. The season and game type pick the partition folders, so other seasons aren't even opened. `team` (`Ev_Team` for the play-by-play, `team` for shifts), `event` and any extra pyarrow `filters` are checked against the row group statistics of each file before its rows are read. All the TOR goals of 2023-24 are `read_store(season=20232024, team='TOR', event='GOAL')`.\n",
+    "\n",
+    "With a store set, `get_play_by_play(game_id)` and `async_get_play_by_play(game_id)` read a game that was final when it was stored straight from the store, without downloading or matching anything."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "d4cb27ec",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "store_dir = None # None turns the Parquet store off\n",
+    "\n",
+    "\n",
+    "def set_store(new_store_dir):\n",
+    "\n",
+    "    global store_dir\n",
+    "    store_dir = new_store_dir\n",
+    "\n",
+    "\n",
+    "def get_season(game_id):\n",
+    "\n",
+    "    # 2023020001 -> 20232024\n",
+    "    start_year = int(str(game_id)[:4])\n",
+    "\n",
+    "    return start_year*10000 + start_year + 1\n",
+    "\n",
+    "\n",
+    "def get_game_type(game_id):\n",
+    "\n",
+    "    # 2023020001 -> 2 (01 preseason, 02 regular season, 03 playoffs, 04 all-star)\n",
+    "    return int(str(game_id)[4:6])\n",
+    "\n",
+    "\n",
+    "def get_store_path(table, game_id):\n",
+    "\n",
+    "    return os.path.join(store_dir, table, 'season={}'.format(get_season(game_id)), 'game_type={}'.format(get_game_type(game_id)),\n",
+    "                        '{}.parquet'.format(game_id))\n",
+    "\n",
+    "\n",
+    "def write_store_table(table, game_id, df):\n",
+    "\n",
+    "    path = get_store_path(table, game_id)\n",
+    "    os.makedirs(os.path.dirname(path), exist_ok=True)\n",
+    "\n",
+    "    # Written under a name starting with '.' (which readers skip) and then moved into place\n",
+    "    tmp_path = os.path.join(os.path.dirname(path), '.{}.{}.tmp'.format(os.path.basename(path), threading.get_ident()))\n",
+    "    df.to_parquet(tmp_path, index=False)\n",
+    "    os.replace(tmp_path, path)\n",
+    "\n",
+    "\n",
+    "def write_game(game_id, pbp=None, shifts=None, game_state=None):\n",
+    "\n",
+    "    for table, df in [('pbp', pbp), ('shifts', shifts)]:\n",
+    "        if df is not None:\n",
+    "            write_store_table(table, game_id, df)\n",
+    "\n",
+    "    # The games table records the state each game was in when it was stored\n",
+    "    if game_state is not None:\n",
+    "        write_store_table('games', game_id, pd.DataFrame({'Game_Id' : [game_id], 'Game_State' : [game_state],\n",
+    "                                                          'Stored_At' : [time.strftime('%Y-%m-%dT%H:%M:%S')]}))\n",
+    "\n",
+    "\n",
+    "def store_game(game_id):\n",
+    "\n",
+    "    try:\n",
+    "        pbp_data = get_json('{}/gamecenter/{}/play-by-play'.format(api_web_url, game_id), ('play-by-play', game_id))\n",
+    "        # The shift chart is downloaded once for both the on-ice players and the shifts table\n",
+    "        shift_data = get_json('{}/shiftcharts?cayenneExp=gameId={}'.format(api_stats_url, game_id), ('shiftcharts', game_id))\n",
+    "        pbp = get_play_by_play(game_id, pbp_data=pbp_data, shift_data=shift_data)\n",
+    "        shifts = get_shifts(game_id, shift_data)\n",
+    "        if (pbp is None) or (shifts is None):\n",
+    "            return False\n",
+    "        write_game(game_id, pbp, shifts, pbp_data.get('gameState'))\n",
+    "\n",
+    "    except Exception as e:\n",
+    "        print('Unable to store Game_Id {} because of an issue at'.format(game_id),e)\n",
+    "        return False\n",
+    "\n",
+    "    return True\n",
+    "\n",
+    "\n",
+    "def read_store(table='pbp', columns=None, season=None, game_type=None, team=None, event=None, filters=None):\n",
+    "\n",
+    "    filters = [] if filters is None else list(filters)\n",
+    "    if season is not None:\n",
+    "        filters.append(('season', '=', season))\n",
+    "    if game_type is not None:\n",
+    "        filters.append(('game_type', '=', game_type))\n",
+    "    if team is not None:\n",
+    "        filters.append(('Ev_Team' if table == 'pbp' else 'team', '=', team))\n",
+    "    if event is not None:\n",
+    "        filters.append(('Event', '=', event))\n",
+    "\n",
+    "    return pd.read_parquet(os.path.join(store_dir, table), columns=columns, filters=filters if len(filters) > 0 else None)\n",
+    "\n",
+    "\n",
+    "def get_stored_games(season=None):\n",
+    "\n",
+    "    # Game_Id -> game state when stored\n",
+    "    if os.path.exists(os.path.join(store_dir, 'games')) == False:\n",
+    "        return {}\n",
+    "\n",
+    "    games = read_store('games', columns=['Game_Id','Game_State'], season=season)\n",
+    "\n",
+    "    return dict(zip(games['Game_Id'].tolist(), games['Game_State'].tolist()))\n",
+    "\n",
+    "\n",
+    "def read_stored_game(game_id, table='pbp'):\n",
+    "\n",
+    "    # Only games that were final when stored, since those never change\n",
+    "    games_path = get_store_path('games', game_id)\n",
+    "    path = get_store_path(table, game_id)\n",
+    "\n",
+    "    if (os.path.exists(games_path) == False) or (os.path.exists(path) == False):\n",
+    "        return None\n",
+    "    if pd.read_parquet(games_path)['Game_State'].iloc[0] not in final_states:\n",
+    "        return None\n",
+    "\n",
+    "    return pd.read_parquet(path)"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "a2b03c9e",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# set_store('nhl_store')\n",
+    "# store_game(2023020001)\n",
+    "# read_store(season=20232024, team='TOR', event='GOAL')\n",
+    "# read_store('shifts', columns=['Game_Id','playerId','period','start_seconds','end_seconds'], season=20232024)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "4b0f67dd",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Resumable Backfill\n",
+    "\n",
+    "A long `get_multi_play_by_play` run keeps everything in memory, so if it dies near the end nothing is left. `backfill([list of game ids], manifest_path='backfill_manifest.json', max_workers=1, retry_failed=True)` writes each game to the Parquet store as soon as it is done. It records every game's progress in a JSON manifest:\n",
+    "\n",
+    "- `pending`: not started yet\n",
+    "- `fetched`: play-by-play, boxscore and shifts downloaded\n",
+    "- `attributed`: play-by-play built with the on-ice players\n",
+    "- `written`: saved to the store\n",
+    "- `failed`: stopped with the `error` that was recorded\n",
+    "\n",
+    "The manifest is rewritten (atomically) after every change, so it is never more than one step behind. Running the same backfill again skips the `written` games and picks up the rest, so after a crash only the unfinished games are redone. With `retry_failed=False`, games that failed before are skipped as well. A store has to be set with `set_store` first. Combined with the raw response cache, the retried games don't even need to be downloaded again."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "6e80c225",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "manifest_lock = threading.Lock()\n",
+    "\n",
+    "\n",
+    "def load_manifest(manifest_path):\n",
+    "\n",
+    "    if os.path.exists(manifest_path) == False:\n",
+    "        return {}\n",
+    "\n",
+    "    with open(manifest_path) as f:\n",
+    "        return json.load(f)\n",
+    "\n",
+    "\n",
+    "def save_manifest(manifest_path, manifest):\n",
+    "\n",
+    "    tmp_path = '{}.tmp'.format(manifest_path)\n",
+    "    with open(tmp_path, 'w') as f:\n",
+    "        json.dump(manifest, f, indent=1)\n",
+    "    os.replace(tmp_path, manifest_path)\n",
+    "\n",
+    "\n",
+    "def set_game_status(manifest_path, manifest, game_id, status, error=None):\n",
+    "\n",
+    "    with manifest_lock:\n",
+    "        manifest[str(game_id)] = {'status' : status, 'error' : error, 'updated' : time.strftime('%Y-%m-%dT%H:%M:%S')}\n",
+    "        save_manifest(manifest_path, manifest)\n",
+    "\n",
+    "\n",
+    "def backfill_game(game_id, manifest_path, manifest):\n",
+    "\n",
+    "    try:\n",
+    "        pbp_data = get_json('{}/gamecenter/{}/play-by-play'.format(api_web_url, game_id), ('play-by-play', game_id))\n",
+    "        boxscore = get_json('{}/gamecenter/{}/boxscore'.format(api_web_url, game_id), ('boxscore', game_id))\n",
+    "        shift_data = get_json('{}/shiftcharts?cayenneExp=gameId={}'.format(api_stats_url, game_id), ('shiftcharts', game_id))\n",
+    "        set_game_status(manifest_path, manifest, game_id, 'fetched')\n",
+    "\n",
+    "        # build_play_by_play raises instead of returning None, so whatever went wrong ends up in the manifest\n",
+    "        pbp = build_play_by_play(game_id, pbp_data, boxscore, shift_data)\n",
+    "        shifts = get_shifts(game_id, shift_data)\n",
+    "        set_game_status(manifest_path, manifest, game_id, 'attributed')\n",
+    "\n",
+    "        write_game(game_id, pbp, shifts, pbp_data.get('gameState'))\n",
+    "        set_game_status(manifest_path, manifest, game_id, 'written')\n",
+    "\n",
+    "    except Exception as e:\n",
+    "        set_game_status(manifest_path, manifest, game_id, 'failed', '{}: {}'.format(type(e).__name__, e))\n",
+    "\n",
+    "\n",
+    "def backfill(range_of_ids, manifest_path='backfill_manifest.json', max_workers=1, retry_failed=True):\n",
+    "\n",
+    "    if store_dir is None:\n",
+    "        print('Unable to backfill without a store, use set_store first')\n",
+    "        return None\n",
+    "\n",
+    "    manifest = load_manifest(manifest_path)\n",
+    "    for game_id in range_of_ids:\n",
+    "        manifest.setdefault(str(game_id), {'status' : 'pending', 'error' : None, 'updated' : None})\n",
+    "    save_manifest(manifest_path, manifest)\n",
+    "\n",
+    "    skip = ['written'] if retry_failed == True else ['written','failed']\n",
+    "    remaining = [game_id for game_id in range_of_ids if manifest[str(game_id)]['status'] not in skip]\n",
+    "    print('Backfilling {} of {} games'.format(len(remaining), len(range_of_ids)))\n",
+    "\n",
+    "    with ThreadPoolExecutor(max_workers=max_workers) as executor:\n",
+    "        for game_id in remaining:\n",
+    "            executor.submit(backfill_game, game_id, manifest_path, manifest)\n",
+    "\n",
+    "    failed = [game_id for game_id in range_of_ids if manifest[str(game_id)]['status'] == 'failed']\n",
+    "    if len(failed) > 0:\n",
+    "        print('Unable to backfill {} games:'.format(len(failed)),failed)\n",
+    "\n",
+    "    return manifest"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "7a965112",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# set_store('nhl_store')\n",
+    "# set_cache('raw_cache')\n",
+    "# manifest = backfill(range(2023020001,2023021313), max_workers=8)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "62c5482c",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Schedule\n",
+    "\n",
+    "`get_schedule(season=None, start_date=None, end_date=None, game_types=[2,3])` lists the games of a season (e.g. `20232024`) or of a date range (`'YYYY-MM-DD'`) from the `/v1/schedule/{date}` endpoint. It returns one row per game with its `Game_Id`, date, season, game type, teams and `Game_State` (`FUT`, `PRE`, `LIVE`, `CRIT`, `OFF`, `FINAL`). By default it keeps regular season (`2`) and playoff (`3`) games. Each request returns a week, and the weeks are walked through with the `nextStartDate` the endpoint gives, starting from September 1st for a season. If any week can't be downloaded, `get_schedule` raises a `RuntimeError` instead of returning part of the schedule, and `scrape_season` and `sync` print the issue and return `None` without scraping anything.\n",
+    "\n",
+    "With the raw response cache on, weeks are cached like every other response. A cached week is kept for good once all its games are final. Until then it is only reused for `cache_ttl` seconds, so game states stay current.\n",
+    "\n",
+    "`scrape_season(season, game_types=[2,3], max_workers=1, as_generator=False)` feeds the games of a season that have been played (`OFF` or `FINAL`) into `get_multi_play_by_play`, so no list of game IDs has to be built by hand."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "a80c6c0f",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def get_schedule_week(date):\n",
+    "\n",
+    "    url = '{}/schedule/{}'.format(api_web_url, date)\n",
+    "    cache_key = ('schedule', date)\n",
+    "\n",
+    "    # Weeks with games still to be played (or being played) are only reused for cache_ttl, to keep their state current\n",
+    "    if (cache_dir is not None) & (offline == False):\n",
+    "        week = read_cached_json(cache_key)\n",
+    "        if (week is not None) and all(game.get('gameState') in final_states for day in week.get('gameWeek', []) for game in day.get('games', [])):\n",
+    "            return week\n",
+    "\n",
+    "    return get_json(url, cache_key)\n",
+    "\n",
+    "\n",
+    "def get_schedule(season=None, start_date=None, end_date=None, game_types=[2,3]):\n",
+    "\n",
+    "    if season is not None:\n",
+    "        start_year = int(str(season)[:4])\n",
+    "        start_date = start_date if start_date is not None else '{}-09-01'.format(start_year)\n",
+    "        end_date = end_date if end_date is not None else '{}-08-31'.format(start_year + 1)\n",
+    "\n",
+    "    games = {}\n",
+    "    date = start_date\n",
+    "\n",
+    "    while (date is not None) and ((end_date is None) or (date <= end_date)):\n",
+    "\n",
+    "        # A missing week would leave a hole in the schedule, so the whole walk fails instead\n",
+    "        try:\n",
+    "            week = get_schedule_week(date)\n",
+    "\n",
+    "        except Exception as e:\n",
+    "            raise RuntimeError('Unable to get the schedule for the week of {}'.format(date)) from e\n",
+    "\n",
+    "        for day in week.get('gameWeek', []):\n",
+    "            if (day['date'] < start_date) or ((end_date is not None) and (day['date'] > end_date)):\n",
+    "                continue\n",
+    "            for game in day.get('games', []):\n",
+    "                if (season is not None) and (game.get('season') != int(season)):\n",
+    "                    continue\n",
+    "                if game.get('gameType') not in game_types:\n",
+    "                    continue\n",
+    "                games[game['id']] = {'Game_Id' : game['id'], 'Date' : day['date'], 'Season' : game.get('season'),\n",
+    "                                     'Game_Type' : game.get('gameType'), 'Game_State' : game.get('gameState'),\n",
+    "                                     'Away_Team' : game.get('awayTeam', {}).get('abbrev'),\n",
+    "                                     'Home_Team' : game.get('homeTeam', {}).get('abbrev')}\n",
+    "\n",
+    "        date = week.get('nextStartDate')\n",
+    "\n",
+    "    return pd.DataFrame(list(games.values()), columns=['Game_Id','Date','Season','Game_Type','Game_State','Away_Team','Home_Team'])\n",
+    "\n",
+    "\n",
+    "def scrape_season(season, game_types=[2,3], max_workers=1, as_generator=False):\n",
+    "\n",
+    "    try:\n",
+    "        schedule = get_schedule(season, game_types=game_types)\n",
+    "\n",
+    "    except Exception as e:\n",
+    "        print('Unable to scrape {} because of an issue at'.format(season),e)\n",
+    "        return None\n",
+    "\n",
+    "    played = schedule[schedule['Game_State'].isin(final_states)]\n",
+    "    print('Scraping {} of {} games in {}'.format(len(played), len(schedule), season))\n",
+    "\n",
+    "    return get_multi_play_by_play(played['Game_Id'].tolist(), max_workers, as_generator)"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "406fab52",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "# %%time\n",
+    "\n",
+    "# # Testing\n",
+    "# get_schedule(20232024)\n",
+    "# get_schedule(start_date='2024-01-01', end_date='2024-01-07')\n",
+    "# pbp = scrape_season(20232024, game_types=[3], max_workers=8)"
+   ]
+  },
+  {
+   "cell_type": "markdown",
+   "id": "34037b83",
+   "metadata": {},
+   "source": [
+    "<br>\n",
+    "\n",
+    "### Syncing the Store\n",
+    "\n",
+    "A nightly job that rescrapes the whole season redoes hundreds of games that can't have changed. `sync(season=None, range_of_ids=None, max_workers=1)` only scrapes what is new. It compares the games with the store's `games` table and stores the games that are missing or that were not final (`OFF`/`FINAL`) when they were stored. The games come from the schedule of `season` (only games that have started) or from `range_of_ids`.\n",
+    "\n",
+    "Each game is rewritten as a whole, so the rows of a game (`Game_Id` + `sortOrder`) are replaced in one go. Plays added, changed or removed since the last time are all picked up. The run time then depends on the number of new games rather than the size of the season."
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "19585006",
+   "metadata": {},
+   "outputs": [],
+   "source": [
+    "def sync(season=None, range_of_ids=None, max_workers=1):\n",
+    "\n",
+    "    if store_dir is None:\n",
+    "        print('Unable to sync without a store, use set_store first')\n",
+    "        return None\n",
+    "\n",
+    "    if range_of_ids is None:\n",
+    "        try:\n",
+    "            schedule = get_schedule(season)\n",
+    "\n",
+    "        except Exception as e:\n",
+    "            print('Unable to sync {} because of an issue at'.format(season),e)\n",
+    "            return None\n",
+    "\n",
+    "        range_of_ids = schedule.loc[~schedule['Game_State'].isin(['FUT','PRE']), 'Game_Id'].tolist()\n",
+    "\n",
+    "    stored = get_stored_games(season)\n",
+    "    to_sync = [game_id for game_id in range_of_ids if stored.get(game_id) not in final_states]\n",
+    "    print('Syncing {} of {} games'.format(len(to_sync), len(range_of_ids)))\n",
+    "\n",
+    "    with ThreadPoolExecutor(max_workers=max_workers) as executor:\n",
+    "        results = list(executor.map(store_game, to_sync))\n",
+    "\n",
+    "    failed = [game_id for game_id, result in zip(to_sync, results) if result == False]\n",
+    "    if len(failed) > 0:\n",
+    "        print('Unable to sync {} games:'.format(len(failed)),failed)\n",
+    "\n",
+    "    return [game_id for game_id, result in zip(to_sync, results) if result == True]"
+   ]
+  },
+  {
+   "cell_type": "code",
+   "execution_count": null,
+   "id": "ca49785d",
    "metadata": {},
    "outputs": [],
    "source": [
     "# %%time\n",
     "\n",
     "# # Testing\n",
-    "# get_multi_play_by_play([2020020001,2020020003])"
+    "# set_store('nhl_store')\n",
+    "# sync(20232024, max_workers=8)"
    ]
   },
   {